@@ -0,0 +1,266 @@
+"""Local stand-in for the playtomic API, for benchmarks.
+
+Serves `/api/v1/tenants` and `/api/v1/availability` in the same shape as
+playtomic.io, with a configurable latency and a share of failed requests.
+The answers come from recorded responses when a data directory is given
+(see `record`), and are generated otherwise. Either way the tenants are
+repeated around the searched point until `tenants` of them exist, so the
+same recording can be replayed at any scale.
+
+    python bench/fake_playtomic.py serve --tenants 200 --latency 0.05
+    python bench/fake_playtomic.py record bench/data --lat 45.46 --lon 9.19
+"""
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import urllib.request
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PLAYTOMIC_URL = "https://playtomic.io"
+# Milan, the default location of the bot
+CENTER = (45.463910150000004, 9.190642626255652)
+SURFACES = ["synthetic_grass", "clay", "concrete", "quick"]
+TYPES = ["outdoor", "indoor", "roofed"]
+
+
+def synthetic_tenant(i: int) -> dict:
+    rng = random.Random(i)
+    return {
+        "tenant_id": f"tenant-{i}",
+        "tenant_name": f"Tennis Club {i}",
+        "address": {"coordinate": {"lat": CENTER[0], "lon": CENTER[1]}},
+        "resources": [
+            {
+                "resource_id": f"tenant-{i}-court-{j}",
+                "name": f"Court {j + 1}",
+                "properties": {
+                    "resource_type": rng.choice(TYPES),
+                    "resource_feature": rng.choice(SURFACES),
+                },
+            }
+            for j in range(rng.randint(2, 6))
+        ],
+    }
+
+
+def synthetic_availability(tenant: dict) -> list:
+    """One day of free slots of every court of `tenant`."""
+    rng = random.Random(tenant["tenant_id"])
+    return [
+        {
+            "resource_id": resource["resource_id"],
+            "slots": [
+                {
+                    "start_time": f"{hour:02d}:{minute:02d}:00",
+                    "duration": duration,
+                    "price": f"{rng.choice([10, 12.5, 15, 18, 20, 25, 30])} EUR",
+                }
+                # UTC, 06:00 to 21:30
+                for hour in range(6, 22)
+                for minute in (0, 30)
+                for duration in (60, 90)
+                if rng.random() < 0.3
+            ],
+        }
+        for resource in tenant["resources"]
+    ]
+
+
+class Dataset:
+    """Tenants and their one-day availability, recorded or generated."""
+
+    def __init__(self, tenants: int, data_dir: str | None = None):
+        recorded, availability = [], {}
+        if data_dir:
+            with open(os.path.join(data_dir, "tenants.json")) as f:
+                recorded = json.load(f)
+            with open(os.path.join(data_dir, "availability.json")) as f:
+                availability = json.load(f)
+        self.tenants = []
+        self.availability = {}
+        for i in range(tenants):
+            if recorded:
+                tenant = json.loads(json.dumps(recorded[i % len(recorded)]))
+                template = availability.get(tenant["tenant_id"], [])
+                if i >= len(recorded):
+                    tenant["tenant_id"] = f"{tenant['tenant_id']}-{i}"
+                    tenant["tenant_name"] = f"{tenant['tenant_name']} {i}"
+            else:
+                tenant = synthetic_tenant(i)
+                template = synthetic_availability(tenant)
+            # spiral around the center, ~0.3 km apart
+            angle, radius = i * 2.4, 0.003 * math.sqrt(i)
+            tenant["address"]["coordinate"] = {
+                "lat": CENTER[0] + radius * math.cos(angle),
+                "lon": CENTER[1] + radius * math.sin(angle),
+            }
+            self.tenants.append(tenant)
+            self.availability[tenant["tenant_id"]] = template
+
+    def availability_between(self, tenant_id: str, start: date, end: date) -> list:
+        template = self.availability.get(tenant_id)
+        if template is None:
+            return []
+        days = (end - start).days + 1
+        return [
+            {**entry, "start_date": (start + timedelta(days=i)).isoformat()}
+            for i in range(days)
+            for entry in template
+        ]
+
+
+class FakePlaytomic(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        port: int = 0,
+    ):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.dataset = dataset
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "FakePlaytomic":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.requests = self.errors = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakePlaytomic
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes, don't let them wait for an ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        delay = server.latency + random.uniform(-server.jitter, server.jitter)
+        time.sleep(max(0.0, delay))
+        failed = random.random() < server.error_rate
+        with server._lock:
+            server.requests += 1
+            server.errors += failed
+        if failed:
+            self._send(server.error_status, {"error": "injected"})
+        elif url.path == "/api/v1/tenants":
+            size = int(query.get("size", 100))
+            page = int(query.get("page", 0))
+            self._send(200, server.dataset.tenants[page * size : (page + 1) * size])
+        elif url.path == "/api/v1/availability":
+            self._send(
+                200,
+                server.dataset.availability_between(
+                    query.get("tenant_id", ""),
+                    date.fromisoformat(query["local_start_min"][:10]),
+                    date.fromisoformat(query["local_start_max"][:10]),
+                ),
+            )
+        else:
+            self._send(404, {"error": "not found"})
+
+    def _send(self, status: int, body) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def record(data_dir: str, lat: float, lon: float, radius: int = 50000) -> None:
+    """Save the real tenants around (lat, lon) and today's availability of
+    each, as replayed by `Dataset`."""
+
+    def get(path: str):
+        request = urllib.request.Request(
+            PLAYTOMIC_URL + path, headers={"User-Agent": "booko-bench/1.0"}
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.load(response)
+
+    tenants = get(
+        "/api/v1/tenants?user_id=me&playtomic_status=ACTIVE&sport_id=TENNIS"
+        f"&coordinate={lat}%2C{lon}&radius={radius}&size=100"
+    )
+    today = date.today().isoformat()
+    availability = {}
+    for tenant in tenants:
+        availability[tenant["tenant_id"]] = [
+            {key: value for key, value in entry.items() if key != "start_date"}
+            for entry in get(
+                f"/api/v1/availability?user_id=me&tenant_id={tenant['tenant_id']}"
+                f"&sport_id=TENNIS&local_start_min={today}T00%3A00%3A00"
+                f"&local_start_max={today}T23%3A59%3A59"
+            )
+        ]
+        # stay well within what playtomic tolerates
+        time.sleep(0.2)
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(data_dir, "tenants.json"), "w") as f:
+        json.dump(tenants, f)
+    with open(os.path.join(data_dir, "availability.json"), "w") as f:
+        json.dump(availability, f)
+    print(f"recorded {len(tenants)} tenants in {data_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the fake API")
+    serve.add_argument("--port", type=int, default=8081)
+    serve.add_argument("--tenants", type=int, default=50)
+    serve.add_argument("--data", help="directory written by `record`")
+    serve.add_argument("--latency", type=float, default=0.05, help="seconds")
+    serve.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    serve.add_argument("--error-rate", type=float, default=0.0)
+    serve.add_argument("--error-status", type=int, default=503)
+    rec = commands.add_parser("record", help="record real playtomic answers")
+    rec.add_argument("data")
+    rec.add_argument("--lat", type=float, default=CENTER[0])
+    rec.add_argument("--lon", type=float, default=CENTER[1])
+    options = parser.parse_args()
+
+    if options.command == "record":
+        record(options.data, options.lat, options.lon)
+    else:
+        server = FakePlaytomic(
+            Dataset(options.tenants, options.data),
+            options.latency,
+            options.jitter,
+            options.error_rate,
+            options.error_status,
+            options.port,
+        )
+        print(f"fake playtomic on {server.url}, BOOKO_PLAYTOMIC_URL={server.url}")
+        server.serve_forever()
@@ -0,0 +1,256 @@
+"""Search benchmarks against the local playtomic stand-in.
+
+Runs every combination of tenant count, date count and concurrency through
+the CLI's `get_fields_filtered` (sync), `get_fields_filtered_async` (async)
+and the bot's `handle_dates` (bot, where concurrency is the number of chats
+searching at once), and reports throughput and p50/p99 search latency.
+Caches start empty for every search unless --warm is given.
+
+    python bench/run.py --tenants 20 100 --dates 1 3 --concurrency 1 10
+    python bench/run.py --modes bot --error-rate 0.05 | tee bench_output.txt
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+from fake_playtomic import CENTER, Dataset, FakePlaytomic
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+MODES = ("sync", "async", "bot")
+
+
+def configure(server_url: str, rate_limit: bool) -> None:
+    """Point booko at the fake server; must run before booko is imported."""
+    os.environ["BOOKO_PLAYTOMIC_URL"] = server_url
+    os.environ.setdefault("BOOKO_STORE_DB", ":memory:")
+    os.environ.setdefault("BOOKO_GEOCODE_DB", ":memory:")
+    os.environ.setdefault("BOOKO_BACKOFF_BASE", "0.05")
+    if not rate_limit:
+        # measure booko, not the budget meant for the real playtomic
+        os.environ.setdefault("BOOKO_RATE", "1000000")
+        os.environ.setdefault("BOOKO_BURST", "1000000")
+        os.environ.setdefault("BOOKO_HOST_CONCURRENCY", "1000")
+    sys.path.insert(0, SRC)
+
+
+def reset_caches() -> None:
+    import booko
+    import caches
+    import store
+
+    booko.tenant_cache = caches.TenantCache()
+    booko.availability_cache = caches.AvailabilityCache()
+    booko.slot_store = store.SlotStore(":memory:")
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, text: str = ""):
+        self.text = text
+        self.message_id = next(self._ids)
+
+    async def reply_text(self, text, **kwargs) -> "FakeMessage":
+        return FakeMessage(text)
+
+    async def edit_text(self, text, **kwargs) -> "FakeMessage":
+        self.text = text
+        return self
+
+    async def reply_chat_action(self, **kwargs) -> None:
+        pass
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class FakeUpdate:
+    def __init__(self, chat_id: int, text: str):
+        self.message = FakeMessage(text)
+        self.effective_chat = FakeChat(chat_id)
+        self.callback_query = None
+
+
+class FakeContext:
+    job_queue = None
+    bot = None
+
+    def __init__(self, user_data: dict):
+        self.user_data = user_data
+
+
+def search_args(dates: list[date]) -> dict:
+    return dict(
+        coords=CENTER,
+        field_names=None,
+        max_distance=50,
+        start_hour="00",
+        max_price=100,
+        dates=dates,
+    )
+
+
+def run_sync(dates, concurrency, iterations, warm) -> list[float]:
+    import booko
+
+    latencies = []
+    for _ in range(iterations):
+        if not warm:
+            reset_caches()
+        started = time.perf_counter()
+        booko.get_fields_filtered(**search_args(dates))
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def run_async(dates, concurrency, iterations, warm) -> list[float]:
+    import booko
+    import upstream
+
+    async def run():
+        latencies = []
+        try:
+            for _ in range(iterations):
+                if not warm:
+                    reset_caches()
+                started = time.perf_counter()
+                await booko.get_fields_filtered_async(
+                    **search_args(dates), concurrency=concurrency
+                )
+                latencies.append(time.perf_counter() - started)
+        finally:
+            await upstream.aclose()
+        return latencies
+
+    return asyncio.run(run())
+
+
+def run_bot(dates, concurrency, iterations, warm) -> list[float]:
+    import booko
+    import main
+    import upstream
+
+    args = search_args(dates[:1])
+    user_data = {
+        "coords": args["coords"],
+        "distance": args["max_distance"],
+        "min_hour": args["start_hour"],
+        "max_price": args["max_price"],
+        "surfaces": None,
+    }
+    text = dates[0].strftime("%d-%m")
+
+    async def search(chat_id: int) -> float:
+        started = time.perf_counter()
+        await main.handle_dates(FakeUpdate(chat_id, text), FakeContext(dict(user_data)))
+        return time.perf_counter() - started
+
+    async def run():
+        # asyncio primitives are bound to the loop they are first used on
+        main.search_semaphore = asyncio.Semaphore(main.MAX_CONCURRENT_SEARCHES)
+        latencies = []
+        try:
+            for _ in range(iterations):
+                if not warm:
+                    reset_caches()
+                latencies.extend(
+                    await asyncio.gather(*(search(i) for i in range(concurrency)))
+                )
+        finally:
+            await booko.cancel_refreshes()
+            await upstream.aclose()
+        return latencies
+
+    return asyncio.run(run())
+
+
+RUNNERS = {"sync": run_sync, "async": run_async, "bot": run_bot}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--tenants", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--dates", type=int, nargs="+", default=[1, 3, 7])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--data", help="recorded responses, see fake_playtomic")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument(
+        "--warm", action="store_true", help="keep the caches between searches"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        action="store_true",
+        help="keep booko's default upstream rate limits",
+    )
+    options = parser.parse_args()
+
+    server = FakePlaytomic(
+        Dataset(1),
+        options.latency,
+        options.jitter,
+        options.error_rate,
+        options.error_status,
+    ).start()
+    configure(server.url, options.rate_limit)
+    logging.basicConfig(level=logging.ERROR)
+
+    header = (
+        f"{'mode':<6}{'tenants':>8}{'dates':>6}{'conc':>6}{'searches':>9}"
+        f"{'search/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'req/search':>11}"
+        f"{'errors':>7}"
+    )
+    print(
+        f"latency={options.latency}s jitter={options.jitter}s "
+        f"error_rate={options.error_rate} warm={options.warm}"
+    )
+    print(header)
+    print("-" * len(header))
+    today = date.today()
+    for tenants in options.tenants:
+        server.dataset = Dataset(tenants, options.data)
+        for n_dates, mode in itertools.product(options.dates, options.modes):
+            if mode == "bot" and n_dates > 1:
+                # the bot searches a single date
+                continue
+            dates = [today + timedelta(days=i) for i in range(n_dates)]
+            # the sync search has no concurrency knob
+            concurrencies = [1] if mode == "sync" else options.concurrency
+            for concurrency in concurrencies:
+                server.reset_counters()
+                started = time.perf_counter()
+                latencies = RUNNERS[mode](
+                    dates, concurrency, options.iterations, options.warm
+                )
+                elapsed = time.perf_counter() - started
+                print(
+                    f"{mode:<6}{tenants:>8}{n_dates:>6}{concurrency:>6}"
+                    f"{len(latencies):>9}{len(latencies) / elapsed:>10.2f}"
+                    f"{percentile(latencies, 0.5) * 1000:>9.1f}"
+                    f"{percentile(latencies, 0.99) * 1000:>9.1f}"
+                    f"{server.requests / len(latencies):>11.1f}"
+                    f"{server.errors:>7}",
+                    flush=True,
+                )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""Many searches at once, sharing their upstream requests.
+
+Reads query specs from a JSONL file, one search per line, e.g.
+
+    {"id": "anna", "address": "via Roma 1, Milano", "max_distance": 5,
+     "max_price": 25, "start_hour": "18", "dates": ["2026-10-18", "19-10"],
+     "surfaces": ["clay"], "top_k": 3}
+
+(`coords: [lat, lon]` can replace `address`; omitted fields take the CLI
+defaults). Every query's tenants are looked up first, then the union of the
+(tenant, date) pairs they need is fetched, each tenant once for all its
+dates, and every query filters its own results out of the shared answers.
+Upstream requests grow with the distinct tenants, not with the queries.
+
+    python src/batch.py queries.jsonl [--json] [--concurrency 10]
+"""
+import argparse
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Iterable
+
+import httpx
+
+import booko
+import formatting
+import upstream
+from filters import MATCH_ALL, FieldFilter
+from models import Availability, Tenant, TenantResult
+
+logger = logging.getLogger(__name__)
+
+
+def parse_date(value: str) -> date:
+    """ISO dates, or the CLI's DD-MM in the current year."""
+    if len(value) <= 5:
+        day, month = value.split("-")
+        return date(date.today().year, int(month), int(day))
+    return date.fromisoformat(value)
+
+
+@dataclass(slots=True)
+class Query:
+    query_id: str
+    field_filter: FieldFilter
+    dates: list[date]
+    address: str | None = None
+    coords: tuple[float, float] | None = None
+    field_names: list | None = None
+    max_distance: float = 10
+    top_k: int | None = None
+    tenants: list[Tenant] = field(default_factory=list)
+    error: str | None = None
+
+    @classmethod
+    def from_json(cls, spec: dict, default_id: str) -> "Query":
+        today = date.today()
+        dates = spec.get("dates") or [today.isoformat(), str(today + timedelta(1))]
+        coords = spec.get("coords")
+        if coords:
+            lat, lon = coords
+            coords = (float(lat), float(lon))
+        top_k = spec.get("top_k")
+        return cls(
+            query_id=str(spec.get("id", default_id)),
+            field_filter=FieldFilter.build(
+                float(spec.get("max_price", 30)),
+                spec.get("surfaces"),
+                spec.get("types"),
+                spec.get("start_hour", "00"),
+            ),
+            dates=[parse_date(str(_date)) for _date in dates],
+            address=spec.get("address"),
+            coords=coords or None,
+            field_names=spec.get("field_names") or None,
+            max_distance=float(spec.get("max_distance", 10)),
+            top_k=int(top_k) if top_k is not None else None,
+        )
+
+
+def read_queries(lines: Iterable[str]) -> list[Query]:
+    """Queries of every non-empty line; a line that can't be parsed, or
+    reuses the id of an earlier one, becomes a failed query instead of
+    stopping the batch."""
+    queries = []
+    seen_ids = set()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        default_id = f"line-{number}"
+        spec = None
+        try:
+            spec = json.loads(line)
+            query = Query.from_json(spec, default_id)
+            if query.query_id in seen_ids:
+                raise ValueError(f"duplicate id {query.query_id!r}")
+            seen_ids.add(query.query_id)
+            queries.append(query)
+        except (ValueError, TypeError, AttributeError) as e:
+            query_id = spec.get("id", default_id) if isinstance(spec, dict) else None
+            queries.append(
+                Query(
+                    query_id=str(query_id or default_id),
+                    field_filter=MATCH_ALL,
+                    dates=[],
+                    error=f"invalid query: {e}",
+                )
+            )
+    return queries
+
+
+async def fetch_union(
+    needs: Iterable[tuple[list[Tenant], list[date]]],
+    concurrency: int = booko.DEFAULT_CONCURRENCY,
+    timeout: float = booko.DEFAULT_TIMEOUT,
+) -> dict[str, dict[date, list[Availability]] | None]:
+    """Full-day availability of every tenant for the union of the dates it is
+    needed on, one fetch per tenant. Tenants whose fetch failed map to None."""
+    wanted: dict[str, set[date]] = {}
+    tenants: dict[str, Tenant] = {}
+    for need_tenants, dates in needs:
+        for tenant in need_tenants:
+            tenants.setdefault(tenant.tenant_id, tenant)
+            wanted.setdefault(tenant.tenant_id, set()).update(dates)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(tenant_id: str) -> dict[date, list[Availability]] | None:
+        async with semaphore:
+            try:
+                return await booko.get_available_fields_for_tenant_dates_async(
+                    tenants[tenant_id], sorted(wanted[tenant_id]), None, timeout
+                )
+            except httpx.HTTPError as e:
+                logger.warning("availability of %s failed: %r", tenant_id, e)
+                return None
+
+    tenant_ids = list(wanted)
+    fetched = await asyncio.gather(*(fetch(tenant_id) for tenant_id in tenant_ids))
+    return dict(zip(tenant_ids, fetched))
+
+
+async def resolve_tenants(queries: list[Query], timeout: float) -> None:
+    """Geocode and look up the tenants of every query, each distinct address
+    and tenant area once."""
+    addresses = {
+        query.address for query in queries if query.address and not query.coords
+    }
+    coords_of = {}
+    for address in addresses:
+        # nominatim takes one request per second anyway
+        try:
+            coords_of[address] = await booko.get_home_coords_async(address, timeout)
+        except httpx.HTTPError as e:
+            logger.warning("geocoding %r failed: %r", address, e)
+            coords_of[address] = None
+    for query in queries:
+        if query.address and not query.coords:
+            query.coords = coords_of[query.address]
+            if query.coords is None:
+                query.error = f"address not found: {query.address}"
+
+    # one tenants request per cache entry, the queries sharing it hit the cache
+    areas = {}
+    for query in queries:
+        if query.error is None:
+            coords = query.coords or booko.MILAN_COORDS
+            radius = booko.tenants_radius(query.max_distance)
+            areas.setdefault((booko.tenant_cache.cell(coords), radius), query)
+
+    async def lookup(query: Query) -> None:
+        try:
+            query.tenants = await booko.get_tenants_async(
+                query.coords, query.field_names, query.max_distance, timeout
+            )
+        except httpx.HTTPError as e:
+            query.error = f"tenants lookup failed: {e!r}"
+
+    await asyncio.gather(*(lookup(query) for query in areas.values()))
+    await asyncio.gather(*(lookup(query) for query in queries if query.error is None))
+
+
+async def run_batch(
+    queries: list[Query],
+    concurrency: int = booko.DEFAULT_CONCURRENCY,
+    timeout: float = booko.DEFAULT_TIMEOUT,
+) -> dict[str, dict[date, list[TenantResult]]]:
+    """Results of every query by id, in the (date, distance) order of
+    `get_fields_filtered`."""
+    await resolve_tenants(queries, timeout)
+    ready = [query for query in queries if query.error is None]
+    for query in ready:
+        booko.tenant_popularity.record(query.tenants)
+    availability = await fetch_union(
+        ((query.tenants, query.dates) for query in ready), concurrency, timeout
+    )
+    logger.info(
+        "%s queries needed %s distinct tenants", len(queries), len(availability)
+    )
+
+    results = {}
+    for query in ready:
+        found: dict[date, list[TenantResult]] = {}
+        for _date in query.dates:
+            for tenant in query.tenants:
+                by_date = availability.get(tenant.tenant_id)
+                if by_date is None:
+                    continue
+                tenant_result = query.field_filter(tenant, by_date[_date])
+                if tenant_result is not None:
+                    found.setdefault(_date, []).append(tenant_result)
+        results[query.query_id] = booko.trim_top_k(found, query.top_k)
+    return results
+
+
+def result_to_json(found: dict[date, list[TenantResult]]) -> dict:
+    return {
+        str(_date): [
+            {
+                "tenant": tenant_result.tenant.name,
+                "distance": round(tenant_result.distance, 3),
+                "fields": [
+                    {
+                        "name": _field.resource.name,
+                        "type": _field.resource.type.value,
+                        "surface": _field.resource.surface.value,
+                        "slots": [
+                            {
+                                "start": slot.local_start.isoformat(),
+                                "duration": slot.duration,
+                                "price": slot.price,
+                            }
+                            for slot in _field.slots
+                        ],
+                    }
+                    for _field in tenant_result.fields
+                ],
+            }
+            for tenant_result in tenant_results
+        ]
+        for _date, tenant_results in found.items()
+    }
+
+
+def main(args) -> None:
+    with open(args.queries) as f:
+        queries = read_queries(f)
+
+    async def run():
+        try:
+            return await run_batch(queries, args.concurrency, args.timeout)
+        finally:
+            await upstream.aclose()
+
+    results = asyncio.run(run())
+    upstream.close()
+    for query in queries:
+        if args.json:
+            line = {"id": query.query_id}
+            if query.error:
+                line["error"] = query.error
+            else:
+                line["results"] = result_to_json(results[query.query_id])
+            print(json.dumps(line))
+        else:
+            print(f"##### {query.query_id}")
+            if query.error:
+                print(query.error)
+            else:
+                found = results[query.query_id]
+                print(formatting.format_results(found) or "No fields found\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run many searches at once")
+    parser.add_argument("queries", help="JSONL file, one query per line")
+    parser.add_argument("--json", action="store_true", help="print JSONL results")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=booko.DEFAULT_CONCURRENCY,
+        help="max number of availability requests in flight",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=booko.DEFAULT_TIMEOUT,
+        help="timeout in seconds for each upstream request",
+    )
+    main(parser.parse_args())
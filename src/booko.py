@@ -1,95 +1,251 @@
+import asyncio
+import contextlib
+import functools
+import logging
+import os
 import time
-from collections import defaultdict
-
-import requests
-from datetime import date, timedelta, datetime, timezone
-from math import sin, cos, sqrt, atan2, radians
+from collections import defaultdict, deque
+
+import httpx
+
+import caches
+import formatting
+import metrics
+import geo
+import store
+import upstream
+from filters import DEFAULT_SURFACES, DEFAULT_TYPES, MATCH_ALL, FieldFilter
+from models import (
+    Availability,
+    Tenant,
+    TenantResult,
+    parse_availability,
+)
+from datetime import date, timedelta
+from math import sqrt
 from zoneinfo import ZoneInfo
 
 
 DEFAULT_ADDR = "piazza duomo Milan"
-DEFAULT_SURFACES = ["synthetic_grass", "clay", "concrete", "quick"]
-DEFAULT_TYPES = ["outdoor", "indoor", "roofed"]
 MAX_DISTANCE = 10
 MAX_PRICE = 30
 MILAN_COORDS = (45.463910150000004, 9.190642626255652)
-# approximate radius of earth in km
-R = 6373.0
+# radii in meters tenants are asked for, the smallest covering the search
+# is used; cached answers for a larger one serve smaller searches too
+TENANTS_RADII = (5000, 10000, 20000, 30000, 50000)
+TENANTS_RADIUS = TENANTS_RADII[-1]
+TENANTS_PAGE_SIZE = 100
+# pages asked at once after a full one
+TENANTS_PAGE_FANOUT = int(os.environ.get("BOOKO_TENANTS_PAGE_FANOUT", "4"))
+TENANTS_MAX_PAGES = int(os.environ.get("BOOKO_TENANTS_MAX_PAGES", "20"))
+# upper bound of in-flight availability requests for the async search
+DEFAULT_CONCURRENCY = 10
+# seconds
+DEFAULT_TIMEOUT = upstream.DEFAULT_TIMEOUT
+
+GEOCODE_URL = "https://nominatim.openstreetmap.org/search?q={query}&format=json"
+# base url of the playtomic API, pointed elsewhere by the benchmarks
+PLAYTOMIC_URL = os.environ.get("BOOKO_PLAYTOMIC_URL", "https://playtomic.io")
+TENANTS_URL = PLAYTOMIC_URL + "/api/v1/tenants?user_id=me&playtomic_status=ACTIVE&with_properties=ALLOWS_CASH_PAYMENT&coordinate={latitude}%2C{longitude}&sport_id=TENNIS&radius={radius}&size={size}&page={page}"
+AVAILABILITY_URL = PLAYTOMIC_URL + "/api/v1/availability?user_id=me&tenant_id={tenant_id}&sport_id=TENNIS&local_start_min={start_date}T00%3A00%3A00&local_start_max={end_date}T23%3A59%3A59"
+# longest contiguous date range asked in a single availability request
+AVAILABILITY_MAX_DAYS = int(os.environ.get("BOOKO_AVAILABILITY_MAX_DAYS", "7"))
+# seconds a bot search waits for availability before showing the last stored
+# snapshot instead, the fetch goes on in the background
+STALE_AFTER = float(os.environ.get("BOOKO_STALE_AFTER", "3"))
+# seconds a stored snapshot may be shown for when upstream is down or slow
+STALE_MAX_AGE = float(os.environ.get("BOOKO_STALE_MAX_AGE", "21600"))
 
 
 localtz = ZoneInfo("Europe/Rome")
 
+logger = logging.getLogger(__name__)
 
-def calc_distance(point_a: tuple[float, float], point_b: tuple[float, float]):
-    lat1 = radians(point_a[0])
-    lon1 = radians(point_a[1])
-    lat2 = radians(point_b[0])
-    lon2 = radians(point_b[1])
+tenant_cache = caches.TenantCache()
+geocode_cache = caches.GeocodeCache()
+availability_cache = caches.AvailabilityCache()
+tenant_popularity = caches.TenantPopularity()
+slot_store = store.SlotStore()
+# fetches left running after a stale answer by (tenant_id, dates), referenced
+# until they finish; later searches wait on them instead of asking again
+_refreshes: dict[tuple[str, tuple[date, ...]], asyncio.Future] = {}
 
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
+metrics.register_cache("tenants", tenant_cache.stats)
+metrics.register_cache("availability", availability_cache.stats)
+metrics.register_cache("geocode", geocode_cache.stats)
 
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
 
-    distance = R * c
-    return distance
+def parse_home_coords(addresses: list) -> tuple[float, float] | None:
+    if not addresses:
+        return None
+    return float(addresses[0]["lat"]), float(addresses[0]["lon"])
 
 
 def get_home_coords(
     address: str,
 ) -> tuple[float, float]:
-    api_url = "https://nominatim.openstreetmap.org/search?q={query}&format=json"
     if not address:
         address = input(f"Insert your address. (Defaults to: {DEFAULT_ADDR}): ")
         print()
         if not address:
             address = DEFAULT_ADDR
 
-    query_str = address.replace(" ", "+")
-    res = requests.get(api_url.format(query=query_str))
-    addresses = res.json()
-    if not addresses:
-        print("didn't find address")
-        exit(1)
+    addresses = []
+    # the prompt above is not part of the stage
+    with metrics.timed("geocode"):
+        found, coords = geocode_cache.get(address)
+        if not found:
+            query_str = address.replace(" ", "+")
+            addresses = upstream.get_json(GEOCODE_URL.format(query=query_str))
+            coords = parse_home_coords(addresses)
+            geocode_cache.set(address, coords)
     if len(addresses) > 1:
         print(f"Found more than 1 result, going for:{addresses[0]['display_name']}")
+    if coords is None:
+        print("didn't find address")
+        exit(1)
 
-    coords = float(addresses[0]["lat"]), float(addresses[0]["lon"])
     return coords
 
 
+@metrics.timed("geocode")
+async def get_home_coords_async(
+    address: str, timeout: float = DEFAULT_TIMEOUT
+) -> tuple[float, float] | None:
+    """Non-interactive geocoding for the bot: returns None instead of exiting
+    when the address can't be resolved. The geocode cache is SQLite backed,
+    it is read and written in a thread."""
+    found, coords = await asyncio.to_thread(geocode_cache.get, address)
+    if found:
+        return coords
+    query_str = address.replace(" ", "+")
+    addresses = await upstream.get_json_async(
+        GEOCODE_URL.format(query=query_str), timeout=timeout
+    )
+    coords = parse_home_coords(addresses)
+    await asyncio.to_thread(geocode_cache.set, address, coords)
+    return coords
+
+
+def tenants_radius(max_distance) -> int:
+    """Smallest radius in `TENANTS_RADII` reaching `max_distance` km from any
+    point of a cache cell, as tenants are asked around the cell center."""
+    half_diagonal = tenant_cache.cell_size * geo.KM_PER_DEGREE / sqrt(2)
+    needed = (float(max_distance) + half_diagonal) * 1000
+    for radius in TENANTS_RADII:
+        if radius >= needed:
+            return radius
+    logger.warning(
+        "a %s m tenants radius can't cover %s km from every point of a cell",
+        TENANTS_RADIUS,
+        max_distance,
+    )
+    return TENANTS_RADIUS
+
+
+def tenants_url(
+    home_coords: tuple[float, float], radius: int = TENANTS_RADIUS, page: int = 0
+) -> str:
+    # query the center of the cache cell so the cached list fits every user in it
+    lat, lon = tenant_cache.cell(home_coords)
+    return TENANTS_URL.format(
+        latitude=lat, longitude=lon, radius=radius, size=TENANTS_PAGE_SIZE, page=page
+    )
+
+
+def add_tenants_page(tenants: dict[str, Tenant], page: list) -> bool:
+    """Parse a page of tenants into `tenants`, by id; True if it was full."""
+    for tenant_json in page:
+        tenant = Tenant.from_json(tenant_json)
+        tenants.setdefault(tenant.tenant_id, tenant)
+    return len(page) >= TENANTS_PAGE_SIZE
+
+
+def fetch_tenants(home_coords: tuple[float, float], radius: int) -> geo.TenantIndex:
+    tenants = {}
+    page = 0
+    while add_tenants_page(
+        tenants, upstream.get_json(tenants_url(home_coords, radius, page))
+    ):
+        page += 1
+        if page >= TENANTS_MAX_PAGES:
+            logger.warning("more than %s pages of tenants", TENANTS_MAX_PAGES)
+            break
+    return geo.TenantIndex(list(tenants.values()))
+
+
+async def fetch_tenants_async(
+    home_coords: tuple[float, float], radius: int, timeout: float = DEFAULT_TIMEOUT
+) -> geo.TenantIndex:
+    """Every tenant within `radius` m. While pages come back full, the next
+    `TENANTS_PAGE_FANOUT` are asked at once and parsed as they arrive."""
+    tenants = {}
+    full = add_tenants_page(
+        tenants,
+        await upstream.get_json_async(
+            tenants_url(home_coords, radius, 0), timeout=timeout
+        ),
+    )
+    first = 1
+    while full:
+        if first >= TENANTS_MAX_PAGES:
+            logger.warning("more than %s pages of tenants", TENANTS_MAX_PAGES)
+            break
+        pages = range(first, min(first + TENANTS_PAGE_FANOUT, TENANTS_MAX_PAGES))
+        tasks = {
+            asyncio.ensure_future(
+                upstream.get_json_async(
+                    tenants_url(home_coords, radius, page), timeout=timeout
+                )
+            ): page
+            for page in pages
+        }
+        pending = set(tasks)
+        full_pages = set()
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if add_tenants_page(tenants, task.result()):
+                        full_pages.add(tasks[task])
+        finally:
+            for task in pending:
+                task.cancel()
+        # pages past the end come back empty, the last full one tells
+        full = pages[-1] in full_pages
+        first = pages[-1] + 1
+    return geo.TenantIndex(list(tenants.values()))
+
+
+@metrics.timed("tenants")
 def get_tenants(
     home_coords: tuple[float, float], field_names: list | None, max_distance
-) -> list:
+) -> list[Tenant]:
     home_coords = home_coords or MILAN_COORDS
-    lat, lon = home_coords
-    tenants_query = "https://playtomic.io/api/v1/tenants?user_id=me&playtomic_status=ACTIVE&with_properties=ALLOWS_CASH_PAYMENT&coordinate={latitude}%2C{longitude}&sport_id=TENNIS&radius=50000&size=100"
-    res = requests.get(tenants_query.format(latitude=lat, longitude=lon))
-    tenants = res.json()
-    filtered_tenants = []
-    if field_names:
-        tenants = filter(
-            lambda x: any(
-                field_name.lower() in x["tenant_name"].lower()
-                for field_name in field_names
-            ),
-            tenants,
-        )
+    radius = tenants_radius(max_distance)
+    index = tenant_cache.get(home_coords, radius)
+    if index is None:
+        index = fetch_tenants(home_coords, radius)
+        tenant_cache.set(home_coords, radius, index)
+    return index.query(home_coords, max_distance, field_names)
 
-    for tenant in tenants:
-        coords = (
-            tenant["address"]["coordinate"]["lat"],
-            tenant["address"]["coordinate"]["lon"],
-        )
-        distance_from_home = calc_distance(coords, home_coords)
-
-        if distance_from_home <= max_distance:
-            tenant.update(distance=distance_from_home)
-            filtered_tenants.append(tenant)
 
-    filtered_tenants.sort(key=lambda x: x["distance"])
-    return filtered_tenants
+@metrics.timed("tenants")
+async def get_tenants_async(
+    home_coords: tuple[float, float],
+    field_names: list | None,
+    max_distance,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> list[Tenant]:
+    home_coords = home_coords or MILAN_COORDS
+    radius = tenants_radius(max_distance)
+    index = tenant_cache.get(home_coords, radius)
+    if index is None:
+        index = await fetch_tenants_async(home_coords, radius, timeout)
+        tenant_cache.set(home_coords, radius, index)
+    return index.query(home_coords, max_distance, field_names)
 
 
 def get_date_range():
@@ -98,42 +254,242 @@ def get_date_range():
     return [today.isoformat(), tomorrow.isoformat()]
 
 
-def get_available_fields_for_tenant(tenant: dict, date: date, start_hour: str):
-    api_url = f"https://playtomic.io/api/v1/availability?user_id=me&tenant_id={tenant['tenant_id']}&sport_id=TENNIS&local_start_min={date}T{start_hour}%3A00%3A00&local_start_max={date}T23%3A59%3A59"
-    res = requests.get(api_url)
-    fields = res.json()
-
-    return fields
-
+def filter_start_hour(
+    availabilities: list[Availability], start_hour: str
+) -> list[Availability]:
+    """Keep the slots starting at `start_hour` (local time) or later, out of
+    a full-day availability."""
+    min_hour = int(start_hour)
+    if min_hour <= 0:
+        return availabilities
+    filtered = []
+    for availability in availabilities:
+        slots = tuple(
+            slot for slot in availability.slots if slot.local_start.hour >= min_hour
+        )
+        if slots:
+            filtered.append(Availability(availability.resource_id, slots))
+    return filtered
 
-def filter_fields(
-    fields: list,
-    max_price: int,
-    surfaces: list | None = None,
-    types: list | None = None,
-):
-    filtered_fields = []
 
-    surfaces = surfaces or DEFAULT_SURFACES
+def availability_url(tenant_id: str, start_date: date, end_date: date) -> str:
+    # always fetch whole days, so any start_hour is served from one entry
+    return AVAILABILITY_URL.format(
+        tenant_id=tenant_id, start_date=start_date, end_date=end_date
+    )
 
-    types = types or DEFAULT_TYPES
 
-    for field in fields:
+def date_windows(dates: list[date], max_days: int = AVAILABILITY_MAX_DAYS):
+    """Group dates into runs of consecutive days, each at most `max_days` long."""
+    windows: list[list[date]] = []
+    for _date in sorted(set(dates)):
         if (
-            field["properties"]["resource_type"] in types
-            and field["properties"]["resource_feature"] in surfaces
+            windows
+            and (_date - windows[-1][-1]).days == 1
+            and len(windows[-1]) < max_days
         ):
-            filtered_slots = list(
-                filter(
-                    lambda x: float(x["price"].replace("EUR", "").strip()) <= max_price,
-                    field["slots"],
-                )
+            windows[-1].append(_date)
+        else:
+            windows.append([_date])
+    return windows
+
+
+def split_by_local_date(
+    availabilities: list[Availability], dates: list[date]
+) -> dict[date, list[Availability]]:
+    """Split a multi-day availability into per-date buckets, the way
+    single-day requests would have returned it."""
+    buckets: dict[date, dict] = {_date: {} for _date in dates}
+    for availability in availabilities:
+        for slot in availability.slots:
+            bucket = buckets.get(slot.local_start.date())
+            if bucket is not None:
+                bucket.setdefault(availability.resource_id, []).append(slot)
+    return {
+        _date: [
+            Availability(resource_id, tuple(slots))
+            for resource_id, slots in bucket.items()
+        ]
+        for _date, bucket in buckets.items()
+    }
+
+
+@metrics.timed("availability")
+def get_available_fields_for_tenant(
+    tenant: Tenant, date: date, start_hour: str
+) -> list[Availability]:
+    key = (tenant.tenant_id, str(date))
+    availabilities = availability_cache.get(key)
+    if availabilities is None:
+        fields = upstream.get_json(availability_url(tenant.tenant_id, date, date))
+        availabilities = parse_availability(fields, date, localtz)
+        availability_cache.set(key, availabilities)
+        slot_store.save(tenant, {date: availabilities})
+
+    return filter_start_hour(availabilities, start_hour)
+
+
+async def fetch_availability_window_async(
+    tenant: Tenant, window: list[date], timeout: float = DEFAULT_TIMEOUT
+) -> dict[date, list[Availability]]:
+    """One request for a run of consecutive dates, split back per date and
+    stored in the availability cache and the slot store."""
+    tenant_id = tenant.tenant_id
+    start_date, end_date = window[0], window[-1]
+    try:
+        fields = await upstream.get_json_async(
+            availability_url(tenant_id, start_date, end_date), timeout=timeout
+        )
+    except httpx.HTTPStatusError as e:
+        if len(window) == 1 or e.response.status_code >= 500:
+            raise
+        # the API refused the window, fall back to one request per day
+        logger.warning("multi-day availability rejected for %s: %r", tenant_id, e)
+        by_date = {}
+        for _date in window:
+            by_date.update(
+                await fetch_availability_window_async(tenant, [_date], timeout)
+            )
+        return by_date
+
+    availabilities = parse_availability(fields, start_date, localtz)
+    if len(window) > 1:
+        by_date = split_by_local_date(availabilities, window)
+    else:
+        by_date = {start_date: availabilities}
+    for _date, day_availabilities in by_date.items():
+        availability_cache.set((tenant_id, str(_date)), day_availabilities)
+    # sqlite commits take milliseconds, keep them off the event loop
+    await asyncio.to_thread(slot_store.save, tenant, by_date)
+    return by_date
+
+
+@metrics.timed("availability")
+async def get_available_fields_for_tenant_dates_async(
+    tenant: Tenant,
+    dates: list[date],
+    start_hour: str | None,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> dict[date, list[Availability]]:
+    """Availability of a tenant for every date in `dates`, asking upstream
+    only for the dates not cached yet, one request per contiguous window.
+
+    With `start_hour` None the full days are returned, for callers applying
+    their own `FieldFilter`.
+    """
+    tenant_id = tenant.tenant_id
+    by_date = {}
+    missing = []
+    for _date in dates:
+        availabilities = availability_cache.get((tenant_id, str(_date)))
+        if availabilities is None:
+            missing.append(_date)
+        else:
+            by_date[_date] = availabilities
+
+    for window in date_windows(missing):
+        by_date.update(
+            await availability_cache.coalesce(
+                (tenant_id, str(window[0]), str(window[-1])),
+                lambda window=window: fetch_availability_window_async(
+                    tenant, window, timeout
+                ),
             )
-            if filtered_slots:
-                filtered_fields.append({**field, "slots": filtered_slots})
-    return filtered_fields
+        )
+
+    if start_hour is None:
+        return {_date: by_date[_date] for _date in dates}
+    return {_date: filter_start_hour(by_date[_date], start_hour) for _date in dates}
 
 
+def stale_availability(
+    tenant: Tenant, dates: list[date]
+) -> tuple[dict[date, list[Availability]], float] | None:
+    """Full-day availability of `tenant` on `dates` from the slot store, up to
+    `STALE_MAX_AGE` seconds old, with when its oldest snapshot was fetched;
+    None unless every date is stored."""
+    stored = slot_store.query([tenant.tenant_id], dates, MATCH_ALL, STALE_MAX_AGE)
+    if len(stored) < len(dates):
+        return None
+    fetched_at = min(slot_store.fetched_at(tenant.tenant_id, dates).values())
+    return {_date: stored[(tenant.tenant_id, _date)] for _date in dates}, fetched_at
+
+
+def _refreshed(key: tuple[str, tuple[date, ...]], fetch: asyncio.Future) -> None:
+    if _refreshes.get(key) is fetch:
+        del _refreshes[key]
+    if not fetch.cancelled() and fetch.exception() is not None:
+        logger.info("background availability refresh failed: %r", fetch.exception())
+
+
+async def cancel_refreshes() -> None:
+    """Stop the fetches left running by stale answers, before the client they
+    use is closed."""
+    refreshes = list(_refreshes.values())
+    for fetch in refreshes:
+        fetch.cancel()
+    await asyncio.gather(*refreshes, return_exceptions=True)
+
+
+async def get_available_fields_or_stale_async(
+    tenant: Tenant,
+    dates: list[date],
+    timeout: float = DEFAULT_TIMEOUT,
+    stale_after: float = STALE_AFTER,
+    gate=contextlib.nullcontext,
+) -> tuple[dict[date, list[Availability]], float | None]:
+    """Full-day availability of `tenant` on `dates` and None, or, when the
+    request fails (circuit open included) or takes longer than `stale_after`
+    seconds, the last stored snapshot and the time it was fetched. A slow
+    fetch is left running, still holding its `gate()`, and refreshes the
+    caches when it lands; until then the same lookup waits on it instead of
+    sending another request.
+
+    Without a stored snapshot to fall back on the fetch is awaited as usual.
+    """
+    key = (tenant.tenant_id, tuple(dates))
+    fetch = _refreshes.get(key)
+    owned = fetch is None
+    if owned:
+
+        async def gated_fetch() -> dict[date, list[Availability]]:
+            async with gate():
+                return await get_available_fields_for_tenant_dates_async(
+                    tenant, dates, None, timeout
+                )
+
+        fetch = asyncio.ensure_future(gated_fetch())
+    try:
+        return await asyncio.wait_for(asyncio.shield(fetch), stale_after), None
+    except (asyncio.TimeoutError, httpx.HTTPError) as e:
+        stale = stale_availability(tenant, dates)
+        if stale is None:
+            if fetch.done():
+                raise
+            return await (fetch if owned else asyncio.shield(fetch)), None
+        if fetch.done():
+            logger.debug("serving stale availability of %s: %r", tenant.name, e)
+        elif owned:
+            _refreshes[key] = fetch
+            fetch.add_done_callback(functools.partial(_refreshed, key))
+        return stale
+    except asyncio.CancelledError:
+        if owned:
+            fetch.cancel()
+        raise
+
+
+def query_slot_store(
+    tenants: list[Tenant], dates: list[date], field_filter: FieldFilter
+) -> dict[tuple[str, date], list[Availability]]:
+    """Already filtered availability of every (tenant_id, date) with a fresh
+    snapshot in the slot store."""
+    return slot_store.query(
+        [tenant.tenant_id for tenant in tenants], dates, field_filter
+    )
+
+
+@metrics.timed("search")
 def get_fields_filtered(
     coords: tuple[float, float],
     field_names: list | None,
@@ -146,51 +502,281 @@ def get_fields_filtered(
 ):
     found_fields : dict[date, list] = defaultdict(list)
 
+    field_filter = FieldFilter.build(max_price, surfaces, types, start_hour)
     tenants = get_tenants(coords, field_names, max_distance)
-    dates = dates
+    stored = query_slot_store(tenants, dates, field_filter)
     for _date in dates:
         for tenant in tenants:
-            tenant_fields_info_by_key = {
-                field_info["resource_id"]: field_info
-                for field_info in tenant["resources"]
-            }
-            fields = get_available_fields_for_tenant(tenant, _date, start_hour)
-            fields = [
-                {**field, **tenant_fields_info_by_key[field["resource_id"]]}
-                for field in fields
-            ]
-            filtered_fields = filter_fields(fields, max_price, surfaces, types)
-            if not filtered_fields:
+            fields = stored.get((tenant.tenant_id, _date))
+            if fields is None:
+                fields = get_available_fields_for_tenant(tenant, _date, start_hour)
+            tenant_result = field_filter(tenant, fields)
+            if tenant_result is None:
                 continue
-            tenant_result = {
-                k: tenant[k]
-                for k in ["tenant_name", "tenant_id", "address", "distance"]
-            }
-            tenant_result["fields"] = filtered_fields
 
             found_fields[_date].append(tenant_result)
     return found_fields
 
 
-def format_results(found_fields: dict[date, dict]):
-    result_str = ""
-    for date, tenants in found_fields.items():
-        result_str += f"Found fields for date: {date}\n"
+def count_slots(tenant_result: TenantResult) -> int:
+    return sum(len(field.slots) for field in tenant_result.fields)
+
+
+def trim_top_k(
+    found_fields: dict[date, list],
+    max_tenants: int | None = None,
+    max_slots: int | None = None,
+) -> dict[date, list]:
+    """Keep, for every date, the nearest `max_tenants` tenants, or the nearest
+    tenants adding up to at least `max_slots` slots."""
+    trimmed: dict[date, list] = defaultdict(list)
+    for _date, tenants in found_fields.items():
+        tenants = sorted(tenants, key=lambda x: x.distance)
+        if max_tenants is not None:
+            tenants = tenants[:max_tenants]
+        if max_slots is not None:
+            slots = 0
+            for i, tenant_result in enumerate(tenants):
+                slots += count_slots(tenant_result)
+                if slots >= max_slots:
+                    tenants = tenants[: i + 1]
+                    break
+        trimmed[_date] = tenants
+    return trimmed
+
+
+async def iter_fields_filtered_async(
+    coords: tuple[float, float],
+    field_names: list | None,
+    max_distance: int,
+    start_hour: str,
+    max_price: int,
+    dates: list[date],
+    surfaces: list | None = None,
+    types: list | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    timeout: float = DEFAULT_TIMEOUT,
+    batch_dates: bool = True,
+    max_tenants: int | None = None,
+    max_slots: int | None = None,
+    raw: dict | None = None,
+    gate=contextlib.nullcontext,
+    stale_after: float | None = None,
+):
+    """Async generator yielding `(date, tenant_result)` as soon as each
+    tenant's availability arrives, in completion order.
+
+    Tenants are queried nearest first, at most `concurrency` at a time. With
+    `batch_dates` each tenant is asked for all its dates in as few requests
+    as the API window allows, instead of one request per date.
+
+    With `max_tenants` (or `max_slots`) no new tenant is queried once, for
+    every date, the nearest tenants answered without a gap (from the slot
+    store or upstream) have that many matches (or slots); the requests
+    already in flight are still yielded, since they are nearer than anything
+    not asked yet, so `trim_top_k` on the results gives the exact nearest K.
+
+    A tenant whose availability request fails or takes longer than `timeout`
+    seconds is skipped for that date instead of failing the whole search.
+    With `stale_after` its last snapshot is shown instead when there is one,
+    also for requests slower than `stale_after` seconds, see
+    `get_available_fields_or_stale_async`; such results carry `fetched_at`.
+    The stale fetches go on in the background: call `cancel_refreshes`
+    before closing the upstream client.
+    Closing the generator early cancels the requests still pending.
+
+    `raw`, when given, is filled with the unfiltered availability of every
+    tenant queried and when it was fetched if stale,
+    `{tenant: {date: (availabilities, fetched_at)}}`, for `refilter_fields`.
+
+    `gate()` is entered around every upstream fetch, the bot passes a slot of
+    its per-chat scheduler.
+    """
+    field_filter = FieldFilter.build(max_price, surfaces, types, start_hour)
+    tenants = await get_tenants_async(coords, field_names, max_distance, timeout)
+    tenant_popularity.record(tenants)
+
+    found_tenants = dict.fromkeys(dates, 0)
+    found_slots = dict.fromkeys(dates, 0)
+    index = {tenant.tenant_id: i for i, tenant in enumerate(tenants)}
+    # per date, the matching slots of every tenant answered so far (None while
+    # unanswered); only the answered nearest-first prefix is counted, stored
+    # snapshots of far tenants must not stop nearer ones from being asked
+    answers = {_date: [None] * len(tenants) for _date in dates}
+    counted = dict.fromkeys(dates, 0)
+
+    def answer(tenant: Tenant, _date: date, tenant_result: TenantResult | None):
+        row = answers[_date]
+        row[index[tenant.tenant_id]] = (
+            count_slots(tenant_result) if tenant_result is not None else 0
+        )
+        while counted[_date] < len(row) and row[counted[_date]] is not None:
+            slots = row[counted[_date]]
+            if slots:
+                found_tenants[_date] += 1
+                found_slots[_date] += slots
+            counted[_date] += 1
+
+    def enough() -> bool:
+        if max_tenants is not None:
+            return all(found >= max_tenants for found in found_tenants.values())
+        if max_slots is not None:
+            return all(found >= max_slots for found in found_slots.values())
+        return False
+
+    async def fetch(tenant: Tenant, _dates: list[date]):
+        try:
+            if stale_after is None:
+                fetched_at = None
+                async with gate():
+                    by_date = await get_available_fields_for_tenant_dates_async(
+                        tenant, _dates, None, timeout
+                    )
+            else:
+                # the gate is held by the fetch itself, up to the end of a
+                # refresh left running after a stale answer
+                by_date, fetched_at = await get_available_fields_or_stale_async(
+                    tenant, _dates, timeout, stale_after, gate
+                )
+        except httpx.HTTPError as e:
+            logger.warning(
+                "availability for %s on %s failed: %r",
+                tenant.name,
+                _dates,
+                e,
+            )
+            by_date, fetched_at = {}, None
+        return tenant, _dates, by_date, fetched_at
+
+    # fresh snapshots are answered by one lookup in the slot store, without
+    # going upstream
+    stored = query_slot_store(
+        tenants, dates, field_filter if raw is None else MATCH_ALL
+    )
+    for _date in dates:
+        for tenant in tenants:
+            fields = stored.get((tenant.tenant_id, _date))
+            if fields is None:
+                continue
+            if raw is not None:
+                raw.setdefault(tenant, {})[_date] = fields, None
+            tenant_result = field_filter(tenant, fields) if fields else None
+            answer(tenant, _date, tenant_result)
+            if tenant_result is not None:
+                yield _date, tenant_result
+
+    # nearest first: tenants are already sorted by distance
+    pending = deque()
+    if batch_dates:
         for tenant in tenants:
-            result_str += f"{tenant['tenant_name']}\n"
-
-            for field in tenant["fields"]:
-                result_str += f"\tSlots for {field['name']} - {field['properties']['resource_type']} - {field['properties']['resource_feature']}\n"
-                for slot in field["slots"]:
-                    start_h = datetime.strptime(slot["start_time"], "%H:%M:%S")
-                    start_h = datetime.combine(
-                        date, start_h.time(), tzinfo=timezone.utc
+            missing = [
+                _date for _date in dates if (tenant.tenant_id, _date) not in stored
+            ]
+            if missing:
+                pending.append((tenant, missing))
+    else:
+        for _date in dates:
+            for tenant in tenants:
+                if (tenant.tenant_id, _date) not in stored:
+                    pending.append((tenant, [_date]))
+    running: set[asyncio.Future] = set()
+
+    def issue():
+        while pending and len(running) < concurrency and not enough():
+            running.add(asyncio.ensure_future(fetch(*pending.popleft())))
+
+    issue()
+    try:
+        while running:
+            done, running = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                tenant, _dates, by_date, fetched_at = task.result()
+                for _date in _dates:
+                    fields = by_date.get(_date)
+                    if raw is not None and fields is not None:
+                        raw.setdefault(tenant, {})[_date] = fields, fetched_at
+                    tenant_result = (
+                        field_filter(tenant, fields, fetched_at) if fields else None
                     )
-                    start_h = start_h.astimezone(localtz)
-                    result_str += f"\t\tat {start_h.strftime('%H:%M')} duration: {slot['duration']} mins PRICE: {slot['price']}\n"
+                    # a failed fetch counts as answered, it won't be retried
+                    answer(tenant, _date, tenant_result)
+                    if tenant_result is not None:
+                        yield _date, tenant_result
+            issue()
+    finally:
+        for task in running:
+            task.cancel()
+
+
+def refilter_fields(
+    raw: dict[Tenant, dict[date, tuple[list[Availability], float | None]]],
+    dates: list[date],
+    start_hour: str,
+    max_price: int,
+    surfaces: list | None = None,
+    types: list | None = None,
+) -> dict[date, list[TenantResult]]:
+    """Filter again the unfiltered availability collected by a search, see
+    `iter_fields_filtered_async`, in (date, distance) order."""
+    field_filter = FieldFilter.build(max_price, surfaces, types, start_hour)
+    tenants = sorted(raw, key=lambda tenant: tenant.distance)
+    found_fields: dict[date, list] = {}
+    for _date in dates:
+        for tenant in tenants:
+            fields, fetched_at = raw[tenant].get(_date, (None, None))
+            if not fields:
+                continue
+            tenant_result = field_filter(tenant, fields, fetched_at)
+            if tenant_result is not None:
+                found_fields.setdefault(_date, []).append(tenant_result)
+    return found_fields
 
-        result_str += "=======================================\n"
-    return result_str
+
+@metrics.timed("search")
+async def get_fields_filtered_async(
+    coords: tuple[float, float],
+    field_names: list | None,
+    max_distance: int,
+    start_hour: str,
+    max_price: int,
+    dates: list[date],
+    surfaces: list | None = None,
+    types: list | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    timeout: float = DEFAULT_TIMEOUT,
+    batch_dates: bool = True,
+    max_tenants: int | None = None,
+    max_slots: int | None = None,
+):
+    """Same result as `get_fields_filtered`, collected from
+    `iter_fields_filtered_async`, optionally limited to the top K."""
+    results_by_date: dict[date, list] = defaultdict(list)
+    async for _date, tenant_result in iter_fields_filtered_async(
+        coords,
+        field_names,
+        max_distance,
+        start_hour,
+        max_price,
+        dates,
+        surfaces,
+        types,
+        concurrency,
+        timeout,
+        batch_dates,
+        max_tenants,
+        max_slots,
+    ):
+        results_by_date[_date].append(tenant_result)
+
+    # keep the (date, distance) order of the sequential version
+    results_by_date = trim_top_k(results_by_date, max_tenants, max_slots)
+    found_fields: dict[date, list] = defaultdict(list)
+    for _date in dates:
+        if results_by_date[_date]:
+            found_fields[_date] = results_by_date[_date]
+    return found_fields
 
 
 def main(args):
@@ -199,19 +785,30 @@ def main(args):
         coords = get_home_coords(args.address)
     else:
         coords = MILAN_COORDS
-    tenants = get_tenants(coords, args.field_names, args.max_distance)
-    dates = args.dates
 
-    found_fields = get_fields_filtered(
-        coords,
-        args.field_names,
-        args.max_distance,
-        args.start_hour,
-        args.max_price,
-        args.dates,
-    )
-    result = format_results(found_fields)
+    async def search():
+        try:
+            return await get_fields_filtered_async(
+                coords,
+                args.field_names,
+                args.max_distance,
+                args.start_hour,
+                args.max_price,
+                args.dates,
+                concurrency=args.concurrency,
+                timeout=args.timeout,
+                max_tenants=args.top_k,
+                max_slots=args.top_k_slots,
+            )
+        finally:
+            await upstream.aclose()
+
+    found_fields = asyncio.run(search())
+    upstream.close()
+    result = formatting.format_results(found_fields)
     print(result)
+    if args.profile:
+        print(metrics.format_profile())
 
 
 # Press the green button in the gutter to run the script.
@@ -277,6 +874,38 @@ if __name__ == "__main__":
         help="[OPTIONAL] days [DD-MM] to look for (space separated list). ",
     )
 
+    parser.add_argument(
+        "-k",
+        "--top-k",
+        type=int,
+        default=None,
+        help="[OPTIONAL] only look for the K nearest centers with a free slot",
+    )
+    parser.add_argument(
+        "--top-k-slots",
+        type=int,
+        default=None,
+        help="[OPTIONAL] stop looking once the nearest centers have K free slots",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="max number of availability requests in flight",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="timeout in seconds for each upstream request",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print how long each stage of the search took",
+    )
+
     options = parser.parse_args()
     main(options)
 
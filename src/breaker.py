@@ -0,0 +1,116 @@
+"""Circuit breakers for the upstream endpoints.
+
+Every endpoint (host and path) has a `CircuitBreaker`. After `threshold`
+failed requests in a row (no answer, or a 5xx) it opens: requests to the
+endpoint fail right away with `CircuitOpen` for `reset_after` seconds,
+instead of piling up behind a service that is down. Then a single probe
+request is let through: if it succeeds the circuit closes again, if it fails
+it stays open for another `reset_after` seconds.
+"""
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# failed requests in a row opening the circuit of an endpoint
+FAILURE_THRESHOLD = int(os.environ.get("BOOKO_BREAKER_FAILURES", "5"))
+# seconds an open circuit rejects requests before letting a probe through
+RESET_AFTER = float(os.environ.get("BOOKO_BREAKER_RESET", "30"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(httpx.HTTPError):
+    """Raised instead of sending a request to an endpoint that is down."""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"circuit open for {endpoint}, retry in {retry_in:.0f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        endpoint: str,
+        threshold: int = FAILURE_THRESHOLD,
+        reset_after: float = RESET_AFTER,
+    ):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def before_request(self) -> None:
+        """Raise `CircuitOpen` unless a request may be sent now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if now < self._open_until:
+                raise CircuitOpen(self.endpoint, self._open_until - now)
+            # let one probe through, the others wait for its outcome; a probe
+            # that never gets an answer is replaced after `reset_after`
+            self.state = HALF_OPEN
+            self._open_until = now + self.reset_after
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                if self.state != CLOSED:
+                    logger.info("circuit of %s closed", self.endpoint)
+                self.state = CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                if self.state == CLOSED:
+                    self.opened += 1
+                    logger.warning(
+                        "circuit of %s opened after %s failures",
+                        self.endpoint,
+                        self.failures,
+                    )
+                self.state = OPEN
+                self._open_until = time.monotonic() + self.reset_after
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opened": self.opened,
+                "open_for": max(0.0, self._open_until - time.monotonic())
+                if self.state != CLOSED
+                else 0.0,
+            }
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def for_url(url: str) -> CircuitBreaker:
+    parsed = urlparse(url)
+    endpoint = f"{parsed.hostname or ''}{parsed.path}"
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+
+def states() -> dict[str, dict]:
+    """Current state of every endpoint contacted so far."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.endpoint: breaker.stats() for breaker in breakers}
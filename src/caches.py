@@ -0,0 +1,276 @@
+"""Caches sitting in front of the upstream APIs."""
+import asyncio
+import bisect
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+
+from cachetools import TTLCache
+
+# tenant lists change a few times a week at most
+TENANT_CACHE_TTL = float(os.environ.get("BOOKO_TENANT_CACHE_TTL", str(6 * 3600)))
+TENANT_CACHE_SIZE = int(os.environ.get("BOOKO_TENANT_CACHE_SIZE", "256"))
+# degrees, ~5km: users closer than that share the same cached tenant list
+TENANT_CACHE_CELL = float(os.environ.get("BOOKO_TENANT_CACHE_CELL", "0.05"))
+
+# seconds, availability changes as people book so keep this short
+AVAILABILITY_CACHE_TTL = float(os.environ.get("BOOKO_AVAILABILITY_TTL", "45"))
+AVAILABILITY_CACHE_SIZE = int(os.environ.get("BOOKO_AVAILABILITY_CACHE_SIZE", "4096"))
+
+# seconds of search history used to rank popular tenants
+POPULARITY_WINDOW = float(os.environ.get("BOOKO_POPULARITY_WINDOW", str(3 * 3600)))
+
+GEOCODE_DB = os.environ.get(
+    "BOOKO_GEOCODE_DB",
+    os.path.join(os.path.expanduser("~"), ".cache", "booko", "geocode.sqlite"),
+)
+GEOCODE_TTL = float(os.environ.get("BOOKO_GEOCODE_TTL", str(30 * 24 * 3600)))
+# addresses that didn't resolve are retried sooner
+GEOCODE_NEGATIVE_TTL = float(
+    os.environ.get("BOOKO_GEOCODE_NEGATIVE_TTL", str(24 * 3600))
+)
+
+
+class TenantCache:
+    """TTL + LRU cache of tenant lists keyed by a quantized coordinate cell and
+    the search radius. Entries are `geo.TenantIndex`es built from the raw API
+    response.
+
+    Lookups are made for the *center* of the cell, so every point inside it
+    maps to the same entry; callers run their own distance and name queries
+    on the returned index, whose tenants must not be mutated. An entry for a
+    larger radius also answers lookups for a smaller one.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = TENANT_CACHE_SIZE,
+        ttl: float = TENANT_CACHE_TTL,
+        cell_size: float = TENANT_CACHE_CELL,
+    ):
+        self.cell_size = cell_size
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        # every radius cached so far, smallest first
+        self._radii: list[int] = []
+        self.hits = 0
+        self.misses = 0
+
+    def cell(self, coords: tuple[float, float]) -> tuple[float, float]:
+        lat, lon = coords
+        return (
+            round((lat // self.cell_size + 0.5) * self.cell_size, 6),
+            round((lon // self.cell_size + 0.5) * self.cell_size, 6),
+        )
+
+    def get(self, coords: tuple[float, float], radius: int):
+        """The smallest cached index covering at least `radius` around the
+        cell of `coords`."""
+        cell = self.cell(coords)
+        with self._lock:
+            index = None
+            for cached_radius in self._radii:
+                if cached_radius >= radius:
+                    index = self._cache.get((cell, cached_radius))
+                    if index is not None:
+                        break
+            if index is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return index
+
+    def set(self, coords: tuple[float, float], radius: int, index) -> None:
+        with self._lock:
+            self._cache[(self.cell(coords), radius)] = index
+            if radius not in self._radii:
+                bisect.insort(self._radii, radius)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._cache),
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class AvailabilityCache:
+    """Short-TTL cache of a tenant's full-day availability, keyed by
+    (tenant_id, date).
+
+    `coalesce` deduplicates concurrent misses: the first caller starts the
+    upstream fetch and everyone else asking for the same key awaits it.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = AVAILABILITY_CACHE_SIZE,
+        ttl: float = AVAILABILITY_CACHE_TTL,
+    ):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: tuple) -> list | None:
+        with self._lock:
+            fields = self._cache.get(key)
+            if fields is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return fields
+
+    def set(self, key: tuple, fields: list) -> None:
+        with self._lock:
+            self._cache[key] = fields
+
+    async def coalesce(self, key: tuple, fetch):
+        """Run the no-argument coroutine function `fetch` unless a fetch for
+        `key` is already in flight, in which case await that one instead.
+
+        Storing the result is up to `fetch`.
+        """
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # a cancelled waiter must not cancel the fetch other waiters share
+        return await asyncio.shield(future)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "size": len(self._cache),
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class TenantPopularity:
+    """Sliding window of which tenants recent searches asked for."""
+
+    def __init__(self, window: float = POPULARITY_WINDOW):
+        self.window = window
+        self._queries: deque[tuple[float, str]] = deque()
+        self._counts: Counter = Counter()
+        self._tenants: dict = {}
+        self._lock = threading.Lock()
+
+    def record(self, tenants: list) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for tenant in tenants:
+                self._queries.append((now, tenant.tenant_id))
+                self._counts[tenant.tenant_id] += 1
+                self._tenants[tenant.tenant_id] = tenant
+            self._expire(now)
+
+    def _expire(self, now: float) -> None:
+        while self._queries and now - self._queries[0][0] > self.window:
+            _, tenant_id = self._queries.popleft()
+            self._counts[tenant_id] -= 1
+            if self._counts[tenant_id] <= 0:
+                del self._counts[tenant_id]
+                del self._tenants[tenant_id]
+
+    def top(self, n: int) -> list:
+        """The `n` most searched tenants in the window, most searched first."""
+        with self._lock:
+            self._expire(time.monotonic())
+            return [
+                self._tenants[tenant_id] for tenant_id, _ in self._counts.most_common(n)
+            ]
+
+
+class GeocodeCache:
+    """On-disk address -> coordinates cache, surviving restarts.
+
+    Addresses that didn't resolve are stored too (negative caching) with a
+    shorter TTL, so typos don't hit Nominatim over and over.
+    """
+
+    def __init__(
+        self,
+        path: str = GEOCODE_DB,
+        ttl: float = GEOCODE_TTL,
+        negative_ttl: float = GEOCODE_NEGATIVE_TTL,
+    ):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS geocode (
+                address TEXT PRIMARY KEY,
+                lat REAL,
+                lon REAL,
+                fetched_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(address: str) -> str:
+        # "Piazza Duomo, Milan" and "piazza  duomo milan" share an entry
+        return " ".join(re.sub(r"[^\w\s]", " ", address.lower()).split())
+
+    def get(self, address: str) -> tuple[bool, tuple[float, float] | None]:
+        """Return (found, coords); coords is None for a cached negative."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lat, lon, fetched_at FROM geocode WHERE address = ?",
+                (self.normalize(address),),
+            ).fetchone()
+            if row is not None:
+                lat, lon, fetched_at = row
+                ttl = self.negative_ttl if lat is None else self.ttl
+                if time.time() - fetched_at <= ttl:
+                    self.hits += 1
+                    return True, None if lat is None else (lat, lon)
+            self.misses += 1
+            return False, None
+
+    def set(self, address: str, coords: tuple[float, float] | None) -> None:
+        lat, lon = coords if coords is not None else (None, None)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?)",
+                (self.normalize(address), lat, lon, time.time()),
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
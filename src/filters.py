@@ -0,0 +1,89 @@
+"""Search filters compiled once per query.
+
+A `FieldFilter` holds the user's choices already in the shape the checks
+need: enum sets for surfaces and types, the price bound in cents and the
+start hour as an int. The same instance filters every tenant and date of a
+search, whether the availability was just fetched or comes from a cache.
+"""
+from dataclasses import dataclass
+
+import metrics
+from models import (
+    Availability,
+    Field,
+    ResourceType,
+    Resource,
+    Slot,
+    Surface,
+    Tenant,
+    TenantResult,
+)
+
+DEFAULT_SURFACES = ["synthetic_grass", "clay", "concrete", "quick"]
+DEFAULT_TYPES = ["outdoor", "indoor", "roofed"]
+
+
+@dataclass(slots=True, frozen=True)
+class FieldFilter:
+    max_price_cents: int
+    surfaces: frozenset[Surface]
+    types: frozenset[ResourceType]
+    # local hour, slots starting earlier are dropped
+    min_hour: int = 0
+
+    @classmethod
+    def build(
+        cls,
+        max_price: int,
+        surfaces: list | None = None,
+        types: list | None = None,
+        start_hour: str | int = 0,
+    ) -> "FieldFilter":
+        surfaces = surfaces or DEFAULT_SURFACES
+        types = types or DEFAULT_TYPES
+        return cls(
+            max_price_cents=round(max_price * 100),
+            surfaces=frozenset(s for s in Surface if s.value in surfaces),
+            types=frozenset(t for t in ResourceType if t.value in types),
+            min_hour=int(start_hour),
+        )
+
+    def accepts_resource(self, resource: Resource) -> bool:
+        return resource.type in self.types and resource.surface in self.surfaces
+
+    def accepts_slot(self, slot: Slot) -> bool:
+        return (
+            slot.price_cents <= self.max_price_cents
+            and slot.local_start.hour >= self.min_hour
+        )
+
+    @metrics.timed("filter")
+    def __call__(
+        self,
+        tenant: Tenant,
+        availabilities: list[Availability],
+        fetched_at: float | None = None,
+    ) -> TenantResult | None:
+        """The tenant's matching fields, or None when nothing matches;
+        `fetched_at` marks availability served stale."""
+        filtered_fields = []
+        for availability in availabilities:
+            resource = tenant.resources.get(availability.resource_id)
+            if resource is None or not self.accepts_resource(resource):
+                continue
+            slots = tuple(
+                slot for slot in availability.slots if self.accepts_slot(slot)
+            )
+            if slots:
+                filtered_fields.append(Field(resource, slots))
+        if not filtered_fields:
+            return None
+        return TenantResult(tenant, filtered_fields, fetched_at)
+
+
+# lets every field and slot through, for callers filtering on their own
+MATCH_ALL = FieldFilter(
+    max_price_cents=2**62,
+    surfaces=frozenset(Surface),
+    types=frozenset(ResourceType),
+)
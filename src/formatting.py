@@ -0,0 +1,177 @@
+"""Rendering of search results, shared by the CLI and the bot.
+
+A `Renderer` only holds the templates of one output flavour (plain text,
+Telegram HTML); `format_results` walks the results once and joins the
+rendered pieces. Slot time and price labels repeat a lot across tenants and
+dates, so they are computed once and memoized.
+"""
+import html
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Callable
+
+import metrics
+from models import Slot, TenantResult
+
+SEPARATOR = "=======================================\n"
+
+
+@dataclass(slots=True, frozen=True)
+class Renderer:
+    date_header: str
+    tenant: str
+    field: str
+    slot: str
+    # shown under a tenant whose availability is an old snapshot
+    stale: str = "\t(availability as of {age} ago)\n"
+    escape: Callable[[str], str] = str
+    # currency code -> symbol shown next to prices
+    currencies: tuple[tuple[str, str], ...] = ()
+
+
+PLAIN = Renderer(
+    date_header="Found fields for date: {date}\n",
+    tenant="{name}\n",
+    field="\tSlots for {name} - {type} - {surface}\n",
+    slot="\t\tat {time} duration: {duration} mins PRICE: {price}\n",
+)
+
+HTML = Renderer(
+    date_header="Found fields for date: {date}\n",
+    tenant="\n<b>{name}</b>\n\n",
+    field="\t{name} - {type} - {surface}\n",
+    slot="\t\t\t@ {time} {duration} mins {price}\n",
+    stale="<i>availability as of {age} ago, playtomic is slow or down</i>\n",
+    escape=html.escape,
+    currencies=(("EUR", "€"),),
+)
+
+
+@lru_cache(maxsize=4096)
+def time_label(local_start: datetime) -> str:
+    return local_start.strftime("%H:%M")
+
+
+@lru_cache(maxsize=1024)
+def price_label(price_cents: int, currency: str, renderer: Renderer) -> str:
+    if price_cents % 100:
+        price = f"{price_cents / 100:.2f} {currency}"
+    else:
+        price = f"{price_cents // 100} {currency}"
+    for code, symbol in renderer.currencies:
+        price = price.replace(code, symbol)
+    return price
+
+
+def age_label(fetched_at: float) -> str:
+    minutes = int(time.time() - fetched_at) // 60
+    if minutes < 60:
+        return f"{max(minutes, 1)} min"
+    return f"{minutes // 60} h"
+
+
+def _render_slot(slot: Slot, renderer: Renderer) -> str:
+    return renderer.slot.format(
+        time=time_label(slot.local_start),
+        duration=slot.duration,
+        price=price_label(slot.price_cents, slot.currency, renderer),
+    )
+
+
+def format_date_header(_date: date, renderer: Renderer = PLAIN) -> str:
+    return renderer.date_header.format(date=_date)
+
+
+def format_tenant(tenant_result: TenantResult, renderer: Renderer = PLAIN) -> str:
+    """All the matching fields and slots of one tenant."""
+    escape = renderer.escape
+    parts = [renderer.tenant.format(name=escape(tenant_result.tenant.name))]
+    if tenant_result.fetched_at is not None:
+        parts.append(renderer.stale.format(age=age_label(tenant_result.fetched_at)))
+    for field in tenant_result.fields:
+        resource = field.resource
+        parts.append(
+            renderer.field.format(
+                name=escape(resource.name),
+                type=resource.type.value,
+                surface=resource.surface.value,
+            )
+        )
+        parts.extend(_render_slot(slot, renderer) for slot in field.slots)
+    return "".join(parts)
+
+
+@metrics.timed("format")
+def format_results(
+    found_fields: dict[date, list[TenantResult]], renderer: Renderer = PLAIN
+) -> str:
+    parts = []
+    for _date, tenants in found_fields.items():
+        parts.append(format_date_header(_date, renderer))
+        parts.extend(format_tenant(result, renderer) for result in tenants)
+        parts.append(SEPARATOR)
+    return "".join(parts)
+
+
+def _split_lines(text: str, limit: int) -> list[str]:
+    """Cut a block longer than `limit` on line boundaries."""
+    chunks, current = [], []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        if current and size + len(line) > limit:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(line[:limit])
+        size += len(current[-1])
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+@metrics.timed("format")
+def paginate(
+    found_fields: dict[date, list[TenantResult]],
+    renderer: Renderer = PLAIN,
+    limit: int = 4096,
+) -> list[str]:
+    """Results split in pages of at most `limit` characters, cut on tenant
+    boundaries; a date continued on the next page repeats its header."""
+    pages = []
+    current: list[str] = []
+    size = 0
+
+    def flush():
+        nonlocal current, size
+        if current:
+            pages.append("".join(current))
+        current, size = [], 0
+
+    for _date, tenants in found_fields.items():
+        header = format_date_header(_date, renderer)
+        blocks = [format_tenant(result, renderer) for result in tenants]
+        blocks.append(SEPARATOR)
+        if size + len(header) + len(blocks[0]) > limit:
+            flush()
+        current.append(header)
+        size += len(header)
+        for block in blocks:
+            if size + len(block) <= limit:
+                current.append(block)
+                size += len(block)
+                continue
+            flush()
+            if block is SEPARATOR:
+                # the page break separates the dates already
+                continue
+            current.append(header)
+            size += len(header)
+            # a single tenant too big for a page falls back to line cuts
+            for chunk in _split_lines(block, limit - size):
+                if size + len(chunk) > limit:
+                    flush()
+                current.append(chunk)
+                size += len(chunk)
+    flush()
+    return pages
@@ -0,0 +1,122 @@
+"""In-memory geo index over a tenant list.
+
+Answers "tenants within X km of P, nearest first" with a grid prefilter and
+a vectorized haversine, without touching the network.
+"""
+from collections import defaultdict
+from math import cos, radians
+
+import numpy as np
+
+from models import Tenant
+
+# approximate radius of earth in km
+R = 6373.0
+# km per degree of latitude
+KM_PER_DEGREE = 2 * np.pi * R / 360
+# degrees, size of a grid cell of the prefilter
+GRID_CELL = 0.05
+
+
+def haversine(
+    lats_a: np.ndarray, lons_a: np.ndarray, lats_b: np.ndarray, lons_b: np.ndarray
+) -> np.ndarray:
+    """Haversine distances in km, all angles in radians; inputs broadcast."""
+    dlat = lats_b - lats_a
+    dlon = lons_b - lons_a
+    a = np.sin(dlat / 2) ** 2 + np.cos(lats_a) * np.cos(lats_b) * np.sin(dlon / 2) ** 2
+    return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class TenantIndex:
+    def __init__(self, tenants: list[Tenant], cell_size: float = GRID_CELL):
+        self.tenants = tenants
+        self.cell_size = cell_size
+        coords = np.array(
+            [(tenant.lat, tenant.lon) for tenant in tenants], dtype=float
+        ).reshape(-1, 2)
+        self.lats = coords[:, 0]
+        self.lons = coords[:, 1]
+        self._lats_rad = np.radians(self.lats)
+        self._lons_rad = np.radians(self.lons)
+        grid = defaultdict(list)
+        for i, (lat, lon) in enumerate(coords):
+            grid[self._cell(lat, lon)].append(i)
+        self._grid = {cell: np.array(ids) for cell, ids in grid.items()}
+
+    def __len__(self):
+        return len(self.tenants)
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return int(lat // self.cell_size), int(lon // self.cell_size)
+
+    def _candidates(self, point: tuple[float, float], max_distance: float):
+        """Indices of the tenants in the grid cells overlapping the bounding
+        box of the search circle, in the original (API) order."""
+        lat, lon = point
+        dlat = max_distance / KM_PER_DEGREE
+        # widest in longitude at the edge of the box farthest from the equator
+        dlon = dlat / max(cos(radians(min(abs(lat) + dlat, 90))), 1e-6)
+        min_cell = self._cell(lat - dlat, lon - dlon)
+        max_cell = self._cell(lat + dlat, lon + dlon)
+        n_cells = (max_cell[0] - min_cell[0] + 1) * (max_cell[1] - min_cell[1] + 1)
+        if n_cells > len(self._grid):
+            # the box covers more cells than we have, scan everything
+            return np.arange(len(self.tenants))
+        cells = [
+            self._grid[(i, j)]
+            for i in range(min_cell[0], max_cell[0] + 1)
+            for j in range(min_cell[1], max_cell[1] + 1)
+            if (i, j) in self._grid
+        ]
+        if not cells:
+            return np.empty(0, dtype=int)
+        return np.sort(np.concatenate(cells))
+
+    def _select(
+        self, ids: np.ndarray, distances: np.ndarray, max_distance, field_names
+    ) -> list[Tenant]:
+        within = distances <= max_distance
+        ids, distances = ids[within], distances[within]
+        order = np.argsort(distances, kind="stable")
+        result = []
+        for i, distance in zip(ids[order], distances[order]):
+            tenant = self.tenants[i]
+            if field_names and not any(
+                field_name.lower() in tenant.name.lower() for field_name in field_names
+            ):
+                continue
+            result.append(tenant.at_distance(float(distance)))
+        return result
+
+    def query(
+        self,
+        point: tuple[float, float],
+        max_distance: float,
+        field_names: list | None = None,
+    ) -> list[Tenant]:
+        """Copies of the tenants within `max_distance` km of `point`, with their
+        `distance` set, nearest first."""
+        ids = self._candidates(point, max_distance)
+        distances = haversine(
+            radians(point[0]),
+            radians(point[1]),
+            self._lats_rad[ids],
+            self._lons_rad[ids],
+        )
+        return self._select(ids, distances, max_distance, field_names)
+
+    def query_many(
+        self,
+        points: list[tuple[float, float]],
+        max_distance: float,
+        field_names: list | None = None,
+    ) -> list[list[Tenant]]:
+        """`query` for many points at once, with one points x tenants
+        distance matrix."""
+        points_rad = np.radians(np.asarray(points, dtype=float).reshape(-1, 2))
+        distances = haversine(
+            points_rad[:, :1], points_rad[:, 1:], self._lats_rad, self._lons_rad
+        )
+        ids = np.arange(len(self.tenants))
+        return [self._select(ids, row, max_distance, field_names) for row in distances]
@@ -20,16 +20,36 @@ bot.
 """
 
 
+import asyncio
+import bisect
 import logging
 
 import os
+import time
 import traceback
-from zoneinfo import ZoneInfo
 
+import httpx
 import telegram
+import booko
+import formatting
+import metrics
+import prefetch
+import scheduler
+import upstream
+import watch
 from telegram import __version__ as TG_VER, InlineKeyboardButton, InlineKeyboardMarkup
-from booko import get_fields_filtered, get_home_coords, DEFAULT_SURFACES, DEFAULT_TYPES
-from datetime import date, datetime, timezone
+from booko import (
+    cancel_refreshes,
+    iter_fields_filtered_async,
+    refilter_fields,
+    trim_top_k,
+    get_home_coords_async,
+    DEFAULT_SURFACES,
+    DEFAULT_TYPES,
+    STALE_AFTER,
+)
+from collections import defaultdict
+from datetime import date, datetime
 
 try:
 
@@ -97,6 +117,40 @@ HANDLE_LOCATION, HANDLE_ADDRESS, HANDLE_NAMES, HANDLE_DEFAULT = map(chr, range(7
 
 END = ConversationHandler.END
 
+# per-process cap on searches hitting playtomic at the same time
+MAX_CONCURRENT_SEARCHES = int(os.environ.get("MAX_CONCURRENT_SEARCHES", "4"))
+# seconds a search may wait for a free slot before we give up on it
+SEARCH_QUEUE_TIMEOUT = float(os.environ.get("SEARCH_QUEUE_TIMEOUT", "60"))
+
+search_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+# shares the upstream requests of the running searches fairly between chats
+search_scheduler = scheduler.FairScheduler()
+
+# seconds between two edits of a streamed results message, telegram
+# throttles bots editing the same chat too often
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1"))
+
+MESSAGE_LIMIT = telegram.constants.MessageLimit.TEXT_LENGTH
+# callback data prefix of the results pagination buttons
+PAGE_CALLBACK = "page:"
+# callback data prefix of the buttons filtering the last results again
+REFINE_CALLBACK = "refine:"
+# seconds the unfiltered availability of the last search is kept for refining
+REFINE_TTL = float(os.environ.get("REFINE_TTL", "600"))
+# searches returning more slots than this can't be refined, to bound user_data
+REFINE_MAX_SLOTS = int(os.environ.get("REFINE_MAX_SLOTS", "20000"))
+REFINE_OPTIONS = {
+    "price": ("💶 Price", ["10", "15", "20", "25", "30", "40", "50"]),
+    "surface": ("🎾 Surface", DEFAULT_SURFACES + ["all"]),
+    "hour": ("🕐 Hour", ["00", "08", "10", "12", "15", "17", "18", "19", "20"]),
+    "type": ("🏠 Type", DEFAULT_TYPES + ["all"]),
+}
+
+watch_registry = watch.WatchRegistry()
+
+# seconds between two purges of the past dates in the slot store
+STORE_PURGE_INTERVAL = float(os.environ.get("STORE_PURGE_INTERVAL", "3600"))
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Send message on `/start`."""
@@ -107,6 +161,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
     logger.info("User %s started the conversation.", user.first_name)
     context.user_data.clear()
+    # `/watch` walks through the same filters, then saves them instead of
+    # searching once
+    context.user_data["watch"] = update.message.text.startswith("/watch")
+    # `/fields 3` only looks for the 3 nearest centers with a free slot
+    if context.args and context.args[0].isdigit() and int(context.args[0]) > 0:
+        context.user_data["top_k"] = int(context.args[0])
     # Build InlineKeyboard where each button has a displayed text
 
     # and a string as callback_data
@@ -206,7 +266,19 @@ async def handle_address(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     user = update.message.from_user
     address = update.message.text
-    coords = get_home_coords(address)
+    try:
+        coords = await get_home_coords_async(address)
+    except httpx.HTTPError as e:
+        logger.warning("geocoding %r failed: %r", address, e)
+        await update.message.reply_text(
+            "I can't look addresses up right now, send me your location instead"
+        )
+        return HANDLE_LOCATION
+    if coords is None:
+        await update.message.reply_text(
+            "I couldn't find that address, try again with a different one"
+        )
+        return HANDLE_ADDRESS
     context.user_data["coords"] = coords
     ### do something with address
 
@@ -387,38 +459,196 @@ async def handle_hour(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str
     return DATES_FILTER
 
 
-def format_results(found_fields: dict[str, dict]):
-    result_str = ""
-    localtz = ZoneInfo("Europe/Rome")
+def page_keyboard(
+    page: int, pages: int, refinable: bool = False
+) -> InlineKeyboardMarkup | None:
+    """Pagination buttons, followed by the refine ones if `refinable`."""
+    rows = []
+    if pages > 1:
+        buttons = [(f"{page + 1}/{pages}", page)]
+        if page > 0:
+            buttons.insert(0, ("◀️ Prev", page - 1))
+        if page < pages - 1:
+            buttons.append(("Next ▶️", page + 1))
+        rows.append(
+            [
+                InlineKeyboardButton(text, callback_data=f"{PAGE_CALLBACK}{target}")
+                for text, target in buttons
+            ]
+        )
+    if refinable:
+        rows.append(
+            [
+                InlineKeyboardButton(label, callback_data=f"{REFINE_CALLBACK}{kind}")
+                for kind, (label, _) in REFINE_OPTIONS.items()
+            ]
+        )
+    return InlineKeyboardMarkup(rows) if rows else None
 
-    for date, tenants in found_fields.items():
-        result_str += f"Found fields for date: {date}\n"
-        for tenant in tenants:
-            result_str += f"\n<b>{tenant['tenant_name']}</b>\n\n"
 
-            for field in tenant["fields"]:
-                result_str += f"\t{field['name']} - {field['properties']['resource_type']} - {field['properties']['resource_feature']}\n"
-                for slot in field["slots"]:
-                    start_h = datetime.strptime(slot["start_time"], "%H:%M:%S")
-                    start_h = datetime.combine(
-                        date, start_h.time(), tzinfo=timezone.utc
-                    )
-                    start_h = start_h.astimezone(localtz)
-                    result_str += f"\t\t\t@ {start_h.strftime('%H:%M')} {slot['duration']} mins {slot['price'].replace('EUR', '€')}\n"
+def refine_keyboard(kind: str, current) -> InlineKeyboardMarkup:
+    """The choices of one refine button, the `current` one ticked."""
+    buttons = [
+        InlineKeyboardButton(
+            value + (" ✅" if value == current else ""),
+            callback_data=f"{REFINE_CALLBACK}{kind}:{value}",
+        )
+        for value in REFINE_OPTIONS[kind][1]
+    ]
+    rows = [buttons[i : i + 4] for i in range(0, len(buttons), 4)]
+    rows.append([InlineKeyboardButton("Back", callback_data=f"{REFINE_CALLBACK}back")])
+    return InlineKeyboardMarkup(rows)
+
+
+def keep_last_search(
+    user_data: dict, message_id: int, raw: dict, dates: list[date]
+) -> bool:
+    """Save the unfiltered availability of a search for `handle_refine`,
+    unless it is too big to be kept around."""
+    user_data.pop("last_search", None)
+    slots = sum(
+        len(fields.slots)
+        for by_date in raw.values()
+        for day, _ in by_date.values()
+        for fields in day
+    )
+    if not raw or slots > REFINE_MAX_SLOTS:
+        return False
+    user_data["last_search"] = {
+        "message_id": message_id,
+        "expires": time.monotonic() + REFINE_TTL,
+        "raw": raw,
+        "dates": dates,
+    }
+    return True
+
+
+def last_search(user_data: dict, message_id: int) -> dict | None:
+    """The saved search shown in `message_id`, if it didn't expire."""
+    search = user_data.get("last_search")
+    if search is None or search["message_id"] != message_id:
+        return None
+    if time.monotonic() > search["expires"]:
+        del user_data["last_search"]
+        return None
+    return search
+
+
+async def show_results(
+    update: Update,
+    result_msg: telegram.Message | None,
+    result_str: str,
+    reply_markup: InlineKeyboardMarkup | None = None,
+) -> telegram.Message:
+    """Send the results message, or update it in place if already sent."""
+    if result_msg is None:
+        return await update.message.reply_text(
+            result_str,
+            reply_markup=reply_markup or ReplyKeyboardRemove(),
+            parse_mode=telegram.constants.ParseMode.HTML,
+        )
+    return await result_msg.edit_text(
+        result_str,
+        parse_mode=telegram.constants.ParseMode.HTML,
+        reply_markup=reply_markup,
+    )
 
-        result_str += "=======================================\n"
-    return result_str
+
+async def handle_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show another page of the last results, from `user_data`."""
+    query = update.callback_query
+    saved = context.user_data.get("result_pages")
+    if saved is None or saved["message_id"] != query.message.message_id:
+        await query.answer("These results expired, please search again")
+        return
+    pages = saved["pages"]
+    page = int(query.data[len(PAGE_CALLBACK) :])
+    await query.answer()
+    if page == saved["page"] or not 0 <= page < len(pages):
+        return
+    saved["page"] = page
+    refinable = last_search(context.user_data, query.message.message_id) is not None
+    await query.edit_message_text(
+        pages[page],
+        parse_mode=telegram.constants.ParseMode.HTML,
+        reply_markup=page_keyboard(page, len(pages), refinable),
+    )
+
+
+async def handle_refine(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Filter the last search again with a different price, surface, start
+    hour or field type, from the availability saved in `user_data`."""
+    query = update.callback_query
+    user_data = context.user_data
+    search = last_search(user_data, query.message.message_id)
+    if search is None:
+        await query.answer("These results expired, please search again")
+        return
+    kind, _, value = query.data[len(REFINE_CALLBACK) :].partition(":")
+    selected = {
+        "price": str(user_data["max_price"]),
+        "surface": (user_data.get("surfaces") or ["all"])[0],
+        "hour": user_data["min_hour"],
+        "type": (user_data.get("types") or ["all"])[0],
+    }
+    await query.answer()
+    if kind in REFINE_OPTIONS and not value:
+        await query.edit_message_reply_markup(
+            reply_markup=refine_keyboard(kind, selected[kind])
+        )
+        return
+    if kind == "back":
+        saved = user_data.get("result_pages")
+        if saved is None or saved["message_id"] != query.message.message_id:
+            saved = {"pages": [], "page": 0}
+        await query.edit_message_reply_markup(
+            reply_markup=page_keyboard(saved["page"], len(saved["pages"]), True)
+        )
+        return
+    if kind not in REFINE_OPTIONS or value not in REFINE_OPTIONS[kind][1]:
+        return
+    match kind:
+        case "price":
+            user_data["max_price"] = int(value)
+        case "hour":
+            user_data["min_hour"] = value
+        case "surface":
+            user_data["surfaces"] = None if value == "all" else [value]
+        case "type":
+            user_data["types"] = None if value == "all" else [value]
+
+    found = refilter_fields(
+        search["raw"],
+        search["dates"],
+        user_data["min_hour"],
+        user_data["max_price"],
+        user_data.get("surfaces"),
+        user_data.get("types"),
+    )
+    pages = formatting.paginate(
+        trim_top_k(found, user_data.get("top_k")), formatting.HTML, MESSAGE_LIMIT
+    ) or ["Didn't find any field with these filters"]
+    user_data["result_pages"] = {
+        "message_id": query.message.message_id,
+        "pages": pages,
+        "page": 0,
+    }
+    try:
+        await query.edit_message_text(
+            pages[0],
+            parse_mode=telegram.constants.ParseMode.HTML,
+            reply_markup=page_keyboard(0, len(pages), True),
+        )
+    except telegram.error.BadRequest as e:
+        # same filters picked again, telegram refuses an identical message
+        if "not modified" not in str(e):
+            raise
 
 
 async def handle_dates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
 
     """Stores the selected gender and asks for a photo."""
 
-    msg = await update.message.reply_text(
-        f"Got ya. Let me fetch the results...",
-        # reply_markup=ReplyKeyboardRemove(remove_keyboard = True)
-    )
-    await update.message.reply_chat_action(action=telegram.constants.ChatAction.TYPING)
     today = datetime.today()
 
     # user = update.message.from_user
@@ -427,30 +657,184 @@ async def handle_dates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> st
         f"{today.year}-{date_input.split('-')[1]}-{date_input.split('-')[0]}"
     )
     user_data = context.user_data
-    result = get_fields_filtered(
-        user_data.get("coords", None),
-        user_data.get("field_names", None),
-        user_data["distance"],
-        user_data["min_hour"],
-        user_data["max_price"],
-        [date_input],
-        user_data["surfaces"],
+    if user_data.get("watch"):
+        return await add_watch(update, context, [date_input])
+    msg = await update.message.reply_text(
+        f"Got ya. Let me fetch the results...",
+        # reply_markup=ReplyKeyboardRemove(remove_keyboard = True)
     )
-    result_str = format_results(result)
-    if result_str != "":
-
-        await msg.edit_text("Done")
-        await update.message.reply_text(
-            result_str,
-            reply_markup=ReplyKeyboardRemove(),
-            parse_mode=telegram.constants.ParseMode.HTML,
+    await update.message.reply_chat_action(action=telegram.constants.ChatAction.TYPING)
+    chat_id = update.effective_chat.id
+    if search_semaphore.locked():
+        await msg.edit_text("Lots of searches running, you're in the queue...")
+    elif search_scheduler.busy:
+        await msg.edit_text("Lots of searches running, it may take a bit longer...")
+    # results are shown as they arrive, sorted by distance, editing a single
+    # message at most every STREAM_EDIT_INTERVAL seconds
+    result = defaultdict(list)
+    result_msg = None
+    shown_str = ""
+    # unfiltered availability, kept for the refine buttons
+    raw = {}
+
+    async def stream() -> bool:
+        """Run the search once a search slot is free, False if none freed up
+        in time."""
+        nonlocal result_msg, shown_str
+        try:
+            await asyncio.wait_for(search_semaphore.acquire(), SEARCH_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False
+        last_edit = 0.0
+        try:
+            async for _date, tenant_result in iter_fields_filtered_async(
+                user_data.get("coords", None),
+                user_data.get("field_names", None),
+                user_data["distance"],
+                user_data["min_hour"],
+                user_data["max_price"],
+                [date_input],
+                user_data["surfaces"],
+                max_tenants=user_data.get("top_k"),
+                raw=raw,
+                gate=lambda: search_scheduler.slot(chat_id),
+                stale_after=STALE_AFTER,
+            ):
+                bisect.insort(
+                    result[_date], tenant_result, key=lambda x: x.distance
+                )
+                if time.monotonic() - last_edit < STREAM_EDIT_INTERVAL:
+                    continue
+                # only the first page is streamed, the rest is paged at the end
+                first_page = formatting.paginate(
+                    trim_top_k(result, user_data.get("top_k")),
+                    formatting.HTML,
+                    MESSAGE_LIMIT,
+                )[0]
+                # farther tenants past a full page, or dropped by top_k, leave
+                # it as it is and telegram refuses edits that change nothing
+                if first_page == shown_str:
+                    continue
+                shown_str = first_page
+                result_msg = await show_results(update, result_msg, shown_str)
+                last_edit = time.monotonic()
+        finally:
+            search_semaphore.release()
+        return True
+
+    # a task of its own, so /cancel can stop it, queued or running
+    search = search_scheduler.start(chat_id, stream())
+    try:
+        started = await search.task
+    except asyncio.CancelledError:
+        if not search.cancelled:
+            raise
+        await msg.edit_text("Search cancelled")
+        return END
+    if not started:
+        await msg.edit_text("Too many searches right now, please try again later")
+        return END
+
+    if result:
+        pages = formatting.paginate(
+            trim_top_k(result, user_data.get("top_k")), formatting.HTML, MESSAGE_LIMIT
         )
+        if result_msg is None:
+            result_msg = await show_results(update, result_msg, pages[0])
+        # only the last results can be paged or refined, older buttons answer
+        # "expired"
+        refinable = keep_last_search(
+            user_data, result_msg.message_id, raw, [date_input]
+        )
+        if pages[0] != shown_str or len(pages) > 1 or refinable:
+            result_msg = await show_results(
+                update, result_msg, pages[0], page_keyboard(0, len(pages), refinable)
+            )
+        user_data["result_pages"] = {
+            "message_id": result_msg.message_id,
+            "pages": pages,
+            "page": 0,
+        }
+        await msg.edit_text("Done")
     else:
-        await msg.edit_text("Didn't find any field with selected filters")
+        # nothing matched, but looser filters might
+        refinable = keep_last_search(user_data, msg.message_id, raw, [date_input])
+        await msg.edit_text(
+            "Didn't find any field with selected filters",
+            reply_markup=page_keyboard(0, 0, refinable),
+        )
+
+    return END
+
 
+async def add_watch(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, dates: list[date]
+) -> int:
+    """Save the chosen filters, polled by `watch_job` from now on."""
+    if context.job_queue is None or watch.WATCH_INTERVAL <= 0:
+        await update.message.reply_text("Sorry, watching fields is not available")
+        return END
+    user_data = context.user_data
+    added = watch_registry.add(
+        watch.Watch.build(
+            update.effective_chat.id,
+            user_data.get("coords", None),
+            user_data.get("field_names", None),
+            user_data["distance"],
+            user_data["min_hour"],
+            user_data["max_price"],
+            dates,
+            user_data["surfaces"],
+        )
+    )
+    if not added:
+        await update.message.reply_text(
+            f"You can't have more than {watch_registry.max_per_chat} watches, "
+            "use /unwatch to drop them"
+        )
+        return END
+    await update.message.reply_text(
+        f"Ok, I'll check every {int(watch.WATCH_INTERVAL)} seconds and tell you "
+        "about every new free slot. Use /unwatch to stop.",
+        reply_markup=ReplyKeyboardRemove(),
+    )
     return END
 
 
+async def unwatch(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    removed = watch_registry.remove(update.effective_chat.id)
+    if removed:
+        await update.message.reply_text(f"Stopped {removed} watch(es)")
+    else:
+        await update.message.reply_text("You're not watching any field")
+
+
+async def watch_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Poll every watch once and send each chat its new slots."""
+    notifications = await watch_registry.poll()
+    header = "New free slots!\n\n"
+    for chat_id, found in notifications.items():
+        pages = formatting.paginate(found, formatting.HTML, MESSAGE_LIMIT - len(header))
+        try:
+            for page in pages:
+                await context.bot.send_message(
+                    chat_id,
+                    header + page,
+                    parse_mode=telegram.constants.ParseMode.HTML,
+                )
+        except telegram.error.Forbidden:
+            # the user blocked the bot
+            watch_registry.remove(chat_id)
+        except telegram.error.TelegramError as e:
+            logger.warning("can't notify chat %s: %r", chat_id, e)
+
+
+async def cancel_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stop the running searches of the chat on `/cancel`, also while the
+    conversation waits for them and its fallbacks don't answer."""
+    search_scheduler.cancel(update.effective_chat.id)
+
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
     """Cancels and ends the conversation."""
@@ -490,12 +874,31 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 
     update_str = update.to_dict() if isinstance(update, Update) else str(update)
 
-    await update.message.reply_text(
-        "Something went wrong. Please start again", reply_markup=ReplyKeyboardRemove()
-    )
+    # jobs fail without an update, button presses have no `update.message`
+    if isinstance(update, Update) and update.effective_message:
+        await update.effective_message.reply_text(
+            "Something went wrong. Please start again",
+            reply_markup=ReplyKeyboardRemove(),
+        )
     return END
 
 
+async def prefetch_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Keep the availability of popular tenants warm."""
+    refreshed = await prefetch.prefetch_popular()
+    logger.debug("prefetched availability for %s tenants", refreshed)
+
+
+async def purge_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drop past dates from the slot store, the bot outlives many days."""
+    await asyncio.to_thread(booko.slot_store.purge_past)
+
+
+async def shutdown_upstream(application: Application) -> None:
+    await cancel_refreshes()
+    await upstream.aclose()
+
+
 def main() -> None:
 
     """Run the bot."""
@@ -505,18 +908,27 @@ def main() -> None:
     token = os.environ.get("TOKEN")
     port = os.environ.get("PORT", "7880")
     expose_url = os.environ.get("EXPOSE_URL", "")
-    application = Application.builder().token(token).build()
+    metrics_port = int(os.environ.get("METRICS_PORT", "0"))
+    application = (
+        Application.builder().token(token).post_shutdown(shutdown_upstream).build()
+    )
 
     # Add conversation handler with the states GENDER, PHOTO, LOCATION and BIO
 
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start), CommandHandler("fields", start)],
+        entry_points=[
+            CommandHandler("start", start),
+            CommandHandler("fields", start),
+            CommandHandler("watch", start),
+        ],
         states={
             TENANT_FILTER: [
                 CallbackQueryHandler(tenant_filter_choice),
             ],
             HANDLE_ADDRESS: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_address)
+                MessageHandler(
+                    filters.TEXT & ~filters.COMMAND, handle_address, block=False
+                )
             ],
             HANDLE_LOCATION: [
                 MessageHandler(filters.LOCATION, handle_location),
@@ -536,17 +948,50 @@ def main() -> None:
             HOURS_FILTER: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_hour)
             ],
+            # searches run as background tasks so other chats keep being served
             DATES_FILTER: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_dates)
+                MessageHandler(
+                    filters.TEXT & ~filters.COMMAND, handle_dates, block=False
+                )
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
     )
 
+    # in a group of its own so it runs whatever state the conversation is in
+    application.add_handler(CommandHandler("cancel", cancel_search), group=-1)
+    # before the conversation, whose callback handlers would take any data
+    application.add_handler(
+        CallbackQueryHandler(handle_page, pattern=f"^{PAGE_CALLBACK}\\d+$")
+    )
+    application.add_handler(
+        CallbackQueryHandler(handle_refine, pattern=f"^{REFINE_CALLBACK}")
+    )
     application.add_handler(conv_handler)
+    application.add_handler(CommandHandler("unwatch", unwatch))
     application.add_error_handler(error_handler)
+    if prefetch.PREFETCH_INTERVAL > 0:
+        if application.job_queue is None:
+            logger.warning("APScheduler is not installed, availability prefetch is off")
+        else:
+            application.job_queue.run_repeating(
+                prefetch_job,
+                interval=prefetch.PREFETCH_INTERVAL,
+                first=prefetch.PREFETCH_INTERVAL,
+            )
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(
+            purge_job, interval=STORE_PURGE_INTERVAL, first=STORE_PURGE_INTERVAL
+        )
+    if watch.WATCH_INTERVAL > 0 and application.job_queue is not None:
+        application.job_queue.run_repeating(
+            watch_job, interval=watch.WATCH_INTERVAL, first=watch.WATCH_INTERVAL
+        )
     # Run the bot until the user presses Ctrl-C
     if mode == "webhook":
+        if metrics_port:
+            metrics.serve(metrics_port)
+            logger.info("serving metrics on port %s", metrics_port)
         application.run_webhook(
             listen="0.0.0.0",
             port=port,
@@ -0,0 +1,257 @@
+"""Process-wide timings and counters of searches.
+
+Each stage of a search (geocode, tenants, availability, filter, format) is
+timed with `timed`, as a decorator or a context manager, into one histogram.
+Caches register their `stats()` to report hit ratios, and the current
+limits of every upstream host and circuit of every endpoint are read from
+`ratelimit` and `breaker`. `render` writes all of it in the Prometheus text
+format, `format_profile` as a table for the CLI.
+"""
+import functools
+import inspect
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import breaker
+import ratelimit
+
+# seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label: str, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label value -> [count per bucket, +Inf included], sum, max
+        self._series: dict[str, list] = {}
+
+    def observe(self, label_value: str, value: float) -> None:
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                    0.0,
+                ]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+            series[2] = max(series[2], value)
+
+    def summary(self) -> dict[str, dict]:
+        """count, total, mean and max of every series."""
+        with self._lock:
+            series = {
+                key: (sum(counts), total, _max)
+                for key, (counts, total, _max) in self._series.items()
+            }
+        return {
+            key: {"count": count, "total": total, "mean": total / count, "max": _max}
+            for key, (count, total, _max) in series.items()
+        }
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {
+                key: (list(counts), total)
+                for key, (counts, total, _max) in self._series.items()
+            }
+        for key, (counts, total) in sorted(series.items()):
+            labels = f'{self.label}="{key}"'
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}'
+                )
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: dict[tuple, int] = {}
+
+    def inc(self, *label_values, amount: int = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            labels = ",".join(
+                f'{label}="{label_value}"'
+                for label, label_value in zip(self.labels, label_values)
+            )
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "booko_stage_seconds", "Time spent in each stage of a search.", "stage"
+)
+UPSTREAM_SECONDS = Histogram(
+    "booko_upstream_request_seconds", "Latency of upstream requests.", "host"
+)
+UPSTREAM_REQUESTS = Counter(
+    "booko_upstream_requests_total", "Upstream requests by answer.", ("host", "status")
+)
+
+_caches: dict[str, Callable[[], dict]] = {}
+
+
+def register_cache(name: str, stats: Callable[[], dict]) -> None:
+    """Report `stats()["hits"/"misses"/"hit_ratio"]` of a cache as `name`."""
+    _caches[name] = stats
+
+
+class timed:
+    """Time a block, or every call of a function, as a stage of a search."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._started = 0.0
+
+    def __enter__(self) -> "timed":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        STAGE_SECONDS.observe(self.stage, time.perf_counter() - self._started)
+
+    def __call__(self, func):
+        stage = self.stage
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    STAGE_SECONDS.observe(stage, time.perf_counter() - started)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(stage, time.perf_counter() - started)
+
+        return wrapper
+
+
+def render() -> str:
+    lines = [
+        *STAGE_SECONDS.render(),
+        *UPSTREAM_SECONDS.render(),
+        *UPSTREAM_REQUESTS.render(),
+    ]
+    stats = {name: get_stats() for name, get_stats in sorted(_caches.items())}
+    for metric, key, kind in (
+        ("booko_cache_hits_total", "hits", "counter"),
+        ("booko_cache_misses_total", "misses", "counter"),
+        ("booko_cache_hit_ratio", "hit_ratio", "gauge"),
+    ):
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.extend(
+            f'{metric}{{cache="{name}"}} {cache_stats[key]}'
+            for name, cache_stats in stats.items()
+        )
+    lines.extend(_render_upstream_state())
+    return "\n".join(lines) + "\n"
+
+
+def _render_upstream_state() -> list[str]:
+    lines = []
+    limits = ratelimit.limits()
+    for metric, key, kind in (
+        ("booko_upstream_concurrency_limit", "concurrency", "gauge"),
+        ("booko_upstream_in_flight", "in_flight", "gauge"),
+        ("booko_upstream_throttled_total", "throttled", "counter"),
+        ("booko_upstream_blocked_seconds", "blocked_for", "gauge"),
+    ):
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.extend(
+            f'{metric}{{host="{host}"}} {host_limits[key]}'
+            for host, host_limits in sorted(limits.items())
+        )
+    circuits = breaker.states()
+    lines.append("# TYPE booko_circuit_state gauge")
+    lines.extend(
+        f'booko_circuit_state{{endpoint="{endpoint}",state="{state}"}} '
+        f'{int(circuit["state"] == state)}'
+        for endpoint, circuit in sorted(circuits.items())
+        for state in (breaker.CLOSED, breaker.OPEN, breaker.HALF_OPEN)
+    )
+    lines.append("# TYPE booko_circuit_opened_total counter")
+    lines.extend(
+        f'booko_circuit_opened_total{{endpoint="{endpoint}"}} {circuit["opened"]}'
+        for endpoint, circuit in sorted(circuits.items())
+    )
+    return lines
+
+
+def format_profile() -> str:
+    """Per-stage breakdown of the searches run so far."""
+    lines = [f"{'stage':<14}{'calls':>8}{'total s':>10}{'mean ms':>10}{'max ms':>10}"]
+    for stage, summary in STAGE_SECONDS.summary().items():
+        lines.append(
+            f"{stage:<14}{summary['count']:>8}{summary['total']:>10.3f}"
+            f"{summary['mean'] * 1000:>10.1f}{summary['max'] * 1000:>10.1f}"
+        )
+    for name, get_stats in sorted(_caches.items()):
+        stats = get_stats()
+        lines.append(
+            f"{name} cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_ratio']:.0%})"
+        )
+    return "\n".join(lines)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve `/metrics` from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,176 @@
+"""Typed model of tenants and their availability.
+
+The API JSON is parsed once, when it is fetched: prices become integer cents,
+slot start times become aware datetimes (both UTC and local), surfaces and
+resource types become enums. Caches, filters and formatters all work on
+these objects instead of copying nested dicts around.
+"""
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime, time, timezone, tzinfo
+from enum import Enum
+from functools import lru_cache
+
+
+class Surface(str, Enum):
+    SYNTHETIC_GRASS = "synthetic_grass"
+    CLAY = "clay"
+    CONCRETE = "concrete"
+    QUICK = "quick"
+    OTHER = "other"
+
+    @classmethod
+    def _missing_(cls, value):
+        return cls.OTHER
+
+
+class ResourceType(str, Enum):
+    OUTDOOR = "outdoor"
+    INDOOR = "indoor"
+    ROOFED = "roofed"
+    OTHER = "other"
+
+    @classmethod
+    def _missing_(cls, value):
+        return cls.OTHER
+
+
+@dataclass(slots=True, frozen=True)
+class Resource:
+    resource_id: str
+    name: str
+    type: ResourceType
+    surface: Surface
+
+    @classmethod
+    def from_json(cls, resource: dict) -> "Resource":
+        properties = resource.get("properties", {})
+        return cls(
+            resource_id=resource["resource_id"],
+            name=resource.get("name", ""),
+            type=ResourceType(properties.get("resource_type")),
+            surface=Surface(properties.get("resource_feature")),
+        )
+
+
+@dataclass(slots=True, frozen=True)
+class Tenant:
+    tenant_id: str
+    name: str
+    lat: float
+    lon: float
+    address: dict = field(compare=False)
+    resources: dict[str, Resource] = field(compare=False)
+    # km from the searched point, set on the copies returned by a search
+    distance: float = 0.0
+
+    @classmethod
+    def from_json(cls, tenant: dict) -> "Tenant":
+        coordinate = tenant["address"]["coordinate"]
+        return cls(
+            tenant_id=tenant["tenant_id"],
+            name=tenant["tenant_name"],
+            lat=coordinate["lat"],
+            lon=coordinate["lon"],
+            address=tenant["address"],
+            resources={
+                resource["resource_id"]: Resource.from_json(resource)
+                for resource in tenant.get("resources", [])
+            },
+        )
+
+    def at_distance(self, distance: float) -> "Tenant":
+        return replace(self, distance=distance)
+
+
+@dataclass(slots=True, frozen=True)
+class Slot:
+    start: datetime
+    local_start: datetime
+    # minutes
+    duration: int
+    price_cents: int
+    currency: str
+
+    @property
+    def price(self) -> str:
+        if self.price_cents % 100:
+            return f"{self.price_cents / 100:.2f} {self.currency}"
+        return f"{self.price_cents // 100} {self.currency}"
+
+
+@dataclass(slots=True, frozen=True)
+class Availability:
+    """Free slots of one resource, as returned by the availability API."""
+
+    resource_id: str
+    slots: tuple[Slot, ...]
+
+
+@dataclass(slots=True, frozen=True)
+class Field:
+    """Availability joined with the tenant's resource information."""
+
+    resource: Resource
+    slots: tuple[Slot, ...]
+
+
+@dataclass(slots=True, frozen=True)
+class TenantResult:
+    tenant: Tenant
+    fields: list[Field]
+    # epoch seconds the availability was fetched at when served stale
+    fetched_at: float | None = None
+
+    @property
+    def distance(self) -> float:
+        return self.tenant.distance
+
+
+def parse_price(price: str) -> tuple[int, str]:
+    """Parse "12.5 EUR" into (1250, "EUR")."""
+    amount, _, currency = price.strip().partition(" ")
+    return round(float(amount) * 100), currency.strip() or "EUR"
+
+
+@lru_cache(maxsize=4096)
+def slot_start(start_date: date, start_time: str, tz: tzinfo) -> tuple:
+    """UTC and local start of a slot; every tenant shares the same few
+    (date, start_time) pairs, so the conversion is done once for each."""
+    # playtomic returns slot times in UTC
+    start = datetime.combine(
+        start_date, time.fromisoformat(start_time), tzinfo=timezone.utc
+    )
+    return start, start.astimezone(tz)
+
+
+def parse_slot(start_date: date, slot: dict, tz: tzinfo) -> Slot:
+    start, local_start = slot_start(start_date, slot["start_time"], tz)
+    price_cents, currency = parse_price(slot["price"])
+    return Slot(
+        start=start,
+        local_start=local_start,
+        duration=slot["duration"],
+        price_cents=price_cents,
+        currency=currency,
+    )
+
+
+def parse_availability(fields: list, default_date: date, tz: tzinfo) -> list:
+    """Parse an availability response into `Availability` objects;
+    `default_date` is used for entries without a `start_date`."""
+    availabilities = []
+    for _field in fields:
+        start_date = (
+            date.fromisoformat(_field["start_date"])
+            if "start_date" in _field
+            else default_date
+        )
+        availabilities.append(
+            Availability(
+                resource_id=_field["resource_id"],
+                slots=tuple(
+                    parse_slot(start_date, slot, tz) for slot in _field["slots"]
+                ),
+            )
+        )
+    return availabilities
@@ -0,0 +1,60 @@
+"""Background refresh of the availability of the most searched tenants.
+
+Run periodically from the bot, it keeps today's and tomorrow's availability
+of popular tenants warm in `booko.availability_cache`, so most searches
+never wait for playtomic.
+"""
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+
+import httpx
+
+import booko
+from models import Tenant
+
+logger = logging.getLogger(__name__)
+
+# seconds between two refreshes, keep it below BOOKO_AVAILABILITY_TTL
+PREFETCH_INTERVAL = float(os.environ.get("PREFETCH_INTERVAL", "30"))
+# max upstream requests a single refresh may issue
+PREFETCH_BUDGET = int(os.environ.get("PREFETCH_BUDGET", "20"))
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", "4"))
+PREFETCH_DAYS = int(os.environ.get("PREFETCH_DAYS", "2"))
+
+
+async def prefetch_popular(
+    budget: int = PREFETCH_BUDGET,
+    days: int = PREFETCH_DAYS,
+    concurrency: int = PREFETCH_CONCURRENCY,
+) -> int:
+    """Refresh the availability of the most searched tenants for the next
+    `days` days, issuing at most `budget` requests. Returns how many tenants
+    were refreshed."""
+    today = date.today()
+    dates = [today + timedelta(days=i) for i in range(days)]
+    windows = booko.date_windows(dates)
+    tenants = booko.tenant_popularity.top(budget // len(windows))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def refresh(tenant: Tenant) -> bool:
+        tenant_id = tenant.tenant_id
+        async with semaphore:
+            try:
+                for window in windows:
+                    # same key as searches, so a search arriving meanwhile
+                    # waits for this fetch instead of issuing its own
+                    await booko.availability_cache.coalesce(
+                        (tenant_id, str(window[0]), str(window[-1])),
+                        lambda window=window: booko.fetch_availability_window_async(
+                            tenant, window
+                        ),
+                    )
+            except httpx.HTTPError as e:
+                logger.warning("prefetch for %s failed: %r", tenant.name, e)
+                return False
+        return True
+
+    refreshed = await asyncio.gather(*(refresh(tenant) for tenant in tenants))
+    return sum(refreshed)
@@ -0,0 +1,215 @@
+"""Per-host request budgets for the upstream APIs.
+
+Every request to a host goes through its `HostLimiter`: a token bucket caps
+the request rate, and a concurrency limit caps the requests in flight. The
+concurrency limit adapts AIMD-style: it grows by about one per round trip
+while responses are fine, and is halved on a 429/503 or when the latency
+jumps well above its running average. A `Retry-After` pauses the host
+altogether until it expires.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+# requests per second and bucket size of hosts without an entry below
+DEFAULT_RATE = float(os.environ.get("BOOKO_RATE", "20"))
+DEFAULT_BURST = int(os.environ.get("BOOKO_BURST", "20"))
+# upper bound of the adaptive concurrency limit of every host
+HOST_CONCURRENCY = int(os.environ.get("BOOKO_HOST_CONCURRENCY", "10"))
+# nominatim's usage policy allows one request per second
+HOST_RATES = {"nominatim.openstreetmap.org": (1.0, 1)}
+# a response this many times slower than the average counts as congestion
+LATENCY_SPIKE = float(os.environ.get("BOOKO_LATENCY_SPIKE", "3"))
+# weight of the last response in the latency average
+LATENCY_ALPHA = 0.2
+THROTTLE_STATUSES = frozenset({429, 503})
+# seconds a waiter sleeps at most before checking the limits again
+MAX_WAIT = 1.0
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a `Retry-After` header, in seconds or as a date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    def __init__(
+        self,
+        host: str,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        max_concurrency: int = HOST_CONCURRENCY,
+    ):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        # adapted between 1 and max_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.tokens = float(burst)
+        self.latency: float | None = None
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        # callables waking a request waiting for a free slot
+        self._waiters: deque = deque()
+
+    def _try_acquire(self) -> float | None:
+        """Take a token and a slot, returning 0; otherwise the seconds to wait,
+        or None when waiting for a request in flight to finish."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self.tokens = min(
+                self.burst, self.tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self.in_flight >= math.floor(self.limit):
+                return None
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            self.in_flight += 1
+            return 0.0
+
+    def acquire(self) -> None:
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return
+            if wait is not None:
+                time.sleep(min(wait, MAX_WAIT))
+                continue
+            event = threading.Event()
+            self._waiters.append(event.set)
+            if not event.wait(MAX_WAIT):
+                self._forget(event.set)
+
+    async def acquire_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return
+            if wait is not None:
+                await asyncio.sleep(min(wait, MAX_WAIT))
+                continue
+            future = loop.create_future()
+
+            def wake(future=future):
+                if not future.done():
+                    future.set_result(None)
+
+            def waker(wake=wake):
+                loop.is_closed() or loop.call_soon_threadsafe(wake)
+
+            self._waiters.append(waker)
+            try:
+                await asyncio.wait_for(future, MAX_WAIT)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if not future.done() or future.cancelled():
+                    self._forget(waker)
+
+    def _forget(self, waker) -> None:
+        """Drop the wake-up of a waiter that gave up, so `release` doesn't
+        spend a free slot on it."""
+        try:
+            self._waiters.remove(waker)
+        except ValueError:
+            # already popped by `release`
+            pass
+
+    def release(
+        self,
+        latency: float | None = None,
+        status: int | None = None,
+        retry_after: float | None = None,
+    ) -> None:
+        """Free the slot taken by `acquire` and adapt the limits to how the
+        request went; no `latency` means it never got an answer."""
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+            spike = (
+                latency is not None
+                and self.latency is not None
+                and latency > LATENCY_SPIKE * self.latency
+            )
+            if status in THROTTLE_STATUSES or spike:
+                if status in THROTTLE_STATUSES:
+                    self.throttled += 1
+                # a burst of failures of the requests already in flight is
+                # one congestion signal, not one each
+                if now - self._last_decrease > (self.latency or 1.0):
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+            elif latency is not None:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            # throttled answers come back fast and say nothing about the load,
+            # spikes are kept so that a lasting slowdown becomes the new norm
+            if latency is not None and status not in THROTTLE_STATUSES:
+                self.latency = (
+                    latency
+                    if self.latency is None
+                    else LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.latency
+                )
+            free = math.floor(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            self._waiters.popleft()()
+            free -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "concurrency": math.floor(self.limit),
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "throttled": self.throttled,
+                "latency": self.latency,
+                "blocked_for": max(0.0, self._blocked_until - time.monotonic()),
+            }
+
+
+_limiters: dict[str, HostLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def for_url(url: str) -> HostLimiter:
+    host = urlparse(url).hostname or ""
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            rate, burst = HOST_RATES.get(host, (DEFAULT_RATE, DEFAULT_BURST))
+            limiter = _limiters[host] = HostLimiter(host, rate, burst)
+        return limiter
+
+
+def limits() -> dict[str, dict]:
+    """Current limits of every host contacted so far."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.host: limiter.stats() for limiter in limiters}
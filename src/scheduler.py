@@ -0,0 +1,152 @@
+"""Fair sharing of the upstream budget between the bot's chats.
+
+Every availability fetch of a bot search waits for a slot of the
+`FairScheduler`. Waiting fetches are queued per chat and the free slots go
+round-robin to the chats with something queued, each holding at most
+`per_chat` of them, so a chat searching 7 dates over 40 clubs can't keep a
+one-date search of another chat waiting behind all its requests.
+
+Searches are started through the scheduler too, which lets `/cancel` stop
+every search of a chat along with its queued and in-flight fetches.
+"""
+import asyncio
+import logging
+import os
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Coroutine
+
+logger = logging.getLogger(__name__)
+
+# upstream fetches in flight for the whole bot
+SCHEDULER_CAPACITY = int(os.environ.get("SCHEDULER_CAPACITY", "16"))
+# upstream fetches in flight for a single chat
+CHAT_IN_FLIGHT = int(os.environ.get("CHAT_IN_FLIGHT", "4"))
+
+
+@dataclass(slots=True, eq=False)
+class Search:
+    chat_id: int
+    task: asyncio.Task
+    # set by `FairScheduler.cancel`, tells a user's cancel from a shutdown
+    cancelled: bool = False
+
+
+class FairScheduler:
+    def __init__(
+        self, capacity: int = SCHEDULER_CAPACITY, per_chat: int = CHAT_IN_FLIGHT
+    ):
+        self.capacity = capacity
+        self.per_chat = per_chat
+        self._running = 0
+        self._in_flight: dict[int, int] = defaultdict(int)
+        # chats in round-robin order, each with its waiting fetches
+        self._waiting: dict[int, deque[asyncio.Future]] = {}
+        self._searches: dict[int, set[Search]] = {}
+
+    @property
+    def busy(self) -> bool:
+        return self._running >= self.capacity
+
+    def _can_run(self, chat_id: int) -> bool:
+        return self._in_flight.get(chat_id, 0) < self.per_chat
+
+    async def acquire(self, chat_id: int) -> None:
+        if (
+            self._running < self.capacity
+            and self._can_run(chat_id)
+            and chat_id not in self._waiting
+        ):
+            self._grant(chat_id)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(chat_id, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # granted while being cancelled, hand the slot on
+                self.release(chat_id)
+            else:
+                self._drop_waiter(chat_id, waiter)
+            raise
+
+    def release(self, chat_id: int) -> None:
+        self._running -= 1
+        self._in_flight[chat_id] -= 1
+        if not self._in_flight[chat_id]:
+            del self._in_flight[chat_id]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, chat_id: int):
+        """Hold one of the upstream slots of `chat_id` for the block."""
+        await self.acquire(chat_id)
+        try:
+            yield
+        finally:
+            self.release(chat_id)
+
+    def _grant(self, chat_id: int) -> None:
+        self._running += 1
+        self._in_flight[chat_id] += 1
+
+    def _drop_waiter(self, chat_id: int, waiter: asyncio.Future) -> None:
+        queue = self._waiting.get(chat_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        if not queue:
+            del self._waiting[chat_id]
+
+    def _dispatch(self) -> None:
+        while self._running < self.capacity:
+            chat_id = next(
+                (chat_id for chat_id in self._waiting if self._can_run(chat_id)), None
+            )
+            if chat_id is None:
+                return
+            queue = self._waiting.pop(chat_id)
+            waiter = queue.popleft()
+            if queue:
+                # back of the ring, the other chats go first
+                self._waiting[chat_id] = queue
+            if waiter.done():
+                continue
+            self._grant(chat_id)
+            waiter.set_result(None)
+
+    def start(self, chat_id: int, coro: Coroutine) -> Search:
+        """Run a search of `chat_id` as a task `cancel` can stop."""
+        search = Search(chat_id, asyncio.ensure_future(coro))
+        searches = self._searches.setdefault(chat_id, set())
+        searches.add(search)
+
+        def forget(_):
+            searches.discard(search)
+            if not searches and self._searches.get(chat_id) is searches:
+                del self._searches[chat_id]
+
+        search.task.add_done_callback(forget)
+        return search
+
+    def cancel(self, chat_id: int) -> int:
+        """Cancel the running searches of `chat_id`, returns how many."""
+        searches = self._searches.pop(chat_id, set())
+        for search in searches:
+            search.cancelled = True
+            search.task.cancel()
+        if searches:
+            logger.info("cancelled %s searches of chat %s", len(searches), chat_id)
+        return len(searches)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "waiting": sum(len(queue) for queue in self._waiting.values()),
+            "chats": len(self._in_flight.keys() | self._waiting.keys()),
+        }
@@ -0,0 +1,202 @@
+"""Local SQLite snapshot of fetched availability.
+
+Every fetched slot is stored with its tenant, resource properties, local start
+time and price in cents, indexed so a whole search (dates, start hour, price,
+surfaces, types, tenants) is a single lookup. Each (tenant, date) snapshot
+carries the time it was fetched; older than `max_age` it is ignored, which
+makes the caller fetch it again.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+
+from filters import FieldFilter
+from models import Availability, Slot, Tenant
+
+STORE_DB = os.environ.get(
+    "BOOKO_STORE_DB",
+    os.path.join(os.path.expanduser("~"), ".cache", "booko", "slots.sqlite"),
+)
+# seconds a snapshot is served before it is fetched again
+STORE_MAX_AGE = float(os.environ.get("BOOKO_STORE_MAX_AGE", "60"))
+
+# bump when the tables change, older stores are dropped and rebuilt
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    tenant_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (tenant_id, date)
+);
+CREATE TABLE IF NOT EXISTS slots (
+    tenant_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    resource_type TEXT,
+    surface TEXT,
+    start TEXT NOT NULL,
+    local_start TEXT NOT NULL,
+    local_time TEXT NOT NULL,
+    duration INTEGER,
+    price_cents INTEGER,
+    currency TEXT
+);
+CREATE INDEX IF NOT EXISTS slots_search
+    ON slots (date, local_time, price_cents, surface, resource_type, tenant_id);
+CREATE INDEX IF NOT EXISTS slots_snapshot ON slots (tenant_id, date);
+"""
+
+
+class SlotStore:
+    def __init__(self, path: str = STORE_DB, max_age: float = STORE_MAX_AGE):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+            if version != SCHEMA_VERSION:
+                self._conn.executescript(
+                    "DROP TABLE IF EXISTS slots; DROP TABLE IF EXISTS snapshots;"
+                )
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.executescript(SCHEMA)
+        self.purge_past()
+
+    def purge_past(self) -> None:
+        """Drop the snapshots of past dates, run it daily on long-lived
+        stores."""
+        today = date.today().isoformat()
+        with self._lock:
+            self._conn.execute("DELETE FROM slots WHERE date < ?", (today,))
+            self._conn.execute("DELETE FROM snapshots WHERE date < ?", (today,))
+            self._conn.commit()
+
+    def save(self, tenant: Tenant, by_date: dict[date, list]) -> None:
+        """Replace the snapshots of `tenant` on every date of `by_date` with
+        its full-day availability, in a single commit. Blocking, async
+        callers run it in a thread."""
+        fetched_at = time.time()
+        with self._lock:
+            for _date, availabilities in by_date.items():
+                self._save_day(tenant, _date, availabilities, fetched_at)
+            self._conn.commit()
+
+    def _save_day(
+        self, tenant: Tenant, _date: date, availabilities: list, fetched_at: float
+    ) -> None:
+        rows = []
+        for availability in availabilities:
+            resource = tenant.resources.get(availability.resource_id)
+            for slot in availability.slots:
+                rows.append(
+                    (
+                        tenant.tenant_id,
+                        _date.isoformat(),
+                        availability.resource_id,
+                        resource.type.value if resource else None,
+                        resource.surface.value if resource else None,
+                        slot.start.isoformat(),
+                        slot.local_start.isoformat(),
+                        slot.local_start.strftime("%H:%M"),
+                        slot.duration,
+                        slot.price_cents,
+                        slot.currency,
+                    )
+                )
+        key = (tenant.tenant_id, _date.isoformat())
+        self._conn.execute("DELETE FROM slots WHERE tenant_id = ? AND date = ?", key)
+        self._conn.executemany(
+            "INSERT INTO slots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)", (*key, fetched_at)
+        )
+
+    def fetched_at(self, tenant_id: str, dates: list[date]) -> dict[date, float]:
+        """When the stored snapshots of `tenant_id` on `dates` were fetched."""
+        by_iso = {_date.isoformat(): _date for _date in dates}
+        with self._lock:
+            rows = self._conn.execute(
+                f"""SELECT date, fetched_at FROM snapshots
+                WHERE tenant_id = ? AND date IN ({",".join("?" * len(by_iso))})""",
+                (tenant_id, *by_iso),
+            ).fetchall()
+        return {by_iso[_date]: fetched_at for _date, fetched_at in rows}
+
+    def query(
+        self,
+        tenant_ids: list[str],
+        dates: list[date],
+        field_filter: FieldFilter,
+        max_age: float | None = None,
+    ) -> dict[tuple[str, date], list[Availability]]:
+        """Slots matching the filters, for every fresh (tenant_id, date)
+        snapshot. Fresh snapshots without matching slots map to an empty
+        list; stale or missing ones are left out. `max_age` overrides the
+        store's for this lookup."""
+        if not tenant_ids or not dates:
+            return {}
+        by_iso = {_date.isoformat(): _date for _date in dates}
+        tenants_in = ",".join("?" * len(tenant_ids))
+        dates_in = ",".join("?" * len(by_iso))
+        with self._lock:
+            fresh = self._conn.execute(
+                f"""SELECT tenant_id, date FROM snapshots
+                WHERE tenant_id IN ({tenants_in}) AND date IN ({dates_in})
+                AND fetched_at >= ?""",
+                (
+                    *tenant_ids,
+                    *by_iso,
+                    time.time() - (self.max_age if max_age is None else max_age),
+                ),
+            ).fetchall()
+            if not fresh:
+                return {}
+            rows = self._conn.execute(
+                f"""SELECT tenant_id, date, resource_id, start, local_start,
+                    duration, price_cents, currency
+                FROM slots
+                WHERE date IN ({dates_in})
+                AND local_time >= ?
+                AND price_cents <= ?
+                AND surface IN ({",".join("?" * len(field_filter.surfaces))})
+                AND resource_type IN ({",".join("?" * len(field_filter.types))})
+                AND tenant_id IN ({tenants_in})
+                ORDER BY tenant_id, date, resource_id, start""",
+                (
+                    *by_iso,
+                    f"{field_filter.min_hour:02d}:00",
+                    field_filter.max_price_cents,
+                    *(surface.value for surface in field_filter.surfaces),
+                    *(_type.value for _type in field_filter.types),
+                    *tenant_ids,
+                ),
+            ).fetchall()
+
+        found: dict[tuple[str, date], dict[str, list]] = {
+            (tenant_id, by_iso[_date]): {} for tenant_id, _date in fresh
+        }
+        for tenant_id, _date, resource_id, start, local_start, *slot in rows:
+            slots_by_resource = found.get((tenant_id, by_iso[_date]))
+            if slots_by_resource is None:
+                # stale snapshot
+                continue
+            slots_by_resource.setdefault(resource_id, []).append(
+                Slot(
+                    datetime.fromisoformat(start),
+                    datetime.fromisoformat(local_start),
+                    *slot,
+                )
+            )
+        return {
+            key: [
+                Availability(resource_id, tuple(slots))
+                for resource_id, slots in slots_by_resource.items()
+            ]
+            for key, slots_by_resource in found.items()
+        }
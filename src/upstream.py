@@ -0,0 +1,191 @@
+"""Shared HTTP layer for every upstream call (Playtomic, Nominatim).
+
+One pooled keep-alive client is kept per process (and one async client per
+event loop), so repeated calls to playtomic.io reuse the same TCP+TLS
+connection instead of paying a handshake each time. Every request waits for
+its host's budget in `ratelimit` first, and fails fast with
+`breaker.CircuitOpen` while its endpoint is down.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+import weakref
+
+import httpx
+
+import breaker
+import metrics
+import ratelimit
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = os.environ.get("BOOKO_USER_AGENT", "booko/1.0")
+# needs the optional `h2` package, falls back to HTTP/1.1 when missing
+HTTP2 = os.environ.get("BOOKO_HTTP2", "0") == "1"
+MAX_CONNECTIONS = int(os.environ.get("BOOKO_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("BOOKO_MAX_KEEPALIVE", "10"))
+# seconds an idle connection is kept in the pool
+KEEPALIVE_EXPIRY = 30.0
+DEFAULT_TIMEOUT = 10.0
+
+MAX_RETRIES = int(os.environ.get("BOOKO_MAX_RETRIES", "3"))
+# seconds, doubled at every attempt and capped at BACKOFF_MAX
+BACKOFF_BASE = float(os.environ.get("BOOKO_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = 8.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_client: httpx.Client | None = None
+# httpx connection pools are bound to the loop they were first used on
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _http2_enabled() -> bool:
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("BOOKO_HTTP2 is set but `h2` is not installed, using HTTP/1.1")
+        return False
+    return True
+
+
+def _client_kwargs() -> dict:
+    return dict(
+        http2=_http2_enabled(),
+        timeout=DEFAULT_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        headers={"User-Agent": USER_AGENT, "Accept": "application/json"},
+    )
+
+
+def get_client() -> httpx.Client:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.Client(**_client_kwargs())
+    return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(**_client_kwargs())
+        _async_clients[loop] = client
+    return client
+
+
+def _should_retry(response: httpx.Response | None, attempt: int) -> bool:
+    if attempt >= MAX_RETRIES:
+        return False
+    return response is None or response.status_code in RETRY_STATUSES
+
+
+def _backoff(attempt: int) -> float:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)
+    # full jitter, so retries from concurrent searches don't line up
+    return random.uniform(0, delay)
+
+
+def _release(
+    limiter: ratelimit.HostLimiter,
+    circuit: breaker.CircuitBreaker,
+    started: float,
+    response: httpx.Response | None,
+    error: Exception | None,
+) -> None:
+    if response is not None:
+        circuit.record(response.status_code < 500)
+        latency = time.monotonic() - started
+        metrics.UPSTREAM_SECONDS.observe(limiter.host, latency)
+        metrics.UPSTREAM_REQUESTS.inc(limiter.host, str(response.status_code))
+        limiter.release(
+            latency,
+            response.status_code,
+            ratelimit.parse_retry_after(response.headers.get("Retry-After")),
+        )
+    elif isinstance(error, httpx.TimeoutException):
+        circuit.record(False)
+        metrics.UPSTREAM_REQUESTS.inc(limiter.host, "timeout")
+        limiter.release(time.monotonic() - started)
+    else:
+        if error is not None:
+            circuit.record(False)
+            metrics.UPSTREAM_REQUESTS.inc(limiter.host, "error")
+        limiter.release()
+
+
+def get_json(url: str, timeout: float | None = None):
+    client = get_client()
+    limiter = ratelimit.for_url(url)
+    circuit = breaker.for_url(url)
+    attempt = 0
+    while True:
+        circuit.before_request()
+        limiter.acquire()
+        started = time.monotonic()
+        response = error = None
+        try:
+            response = client.get(url, timeout=timeout or DEFAULT_TIMEOUT)
+        except httpx.TransportError as e:
+            error = e
+            if not _should_retry(None, attempt):
+                raise
+            logger.info("retrying %s after %r", url, e)
+        else:
+            if not _should_retry(response, attempt):
+                response.raise_for_status()
+                return response.json()
+            logger.info("retrying %s after status %s", url, response.status_code)
+        finally:
+            _release(limiter, circuit, started, response, error)
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+async def get_json_async(url: str, timeout: float | None = None):
+    client = get_async_client()
+    limiter = ratelimit.for_url(url)
+    circuit = breaker.for_url(url)
+    attempt = 0
+    while True:
+        circuit.before_request()
+        await limiter.acquire_async()
+        started = time.monotonic()
+        response = error = None
+        try:
+            response = await client.get(url, timeout=timeout or DEFAULT_TIMEOUT)
+        except httpx.TransportError as e:
+            error = e
+            if not _should_retry(None, attempt):
+                raise
+            logger.info("retrying %s after %r", url, e)
+        else:
+            if not _should_retry(response, attempt):
+                response.raise_for_status()
+                return response.json()
+            logger.info("retrying %s after status %s", url, response.status_code)
+        finally:
+            _release(limiter, circuit, started, response, error)
+        await asyncio.sleep(_backoff(attempt))
+        attempt += 1
+
+
+def close() -> None:
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+async def aclose() -> None:
+    """Close the async client of the running loop."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,174 @@
+"""Saved searches polled in the background.
+
+A `Watch` keeps a chat's filters and the slots it was last shown. All the
+watches are polled together: the (tenant, date) pairs they need are collected
+first and each tenant is fetched once for all its dates, however many watches
+share it. Every watch then diffs its matches against its last snapshot, so
+only the slots that opened up since are notified.
+"""
+import logging
+import os
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date
+
+import httpx
+
+import batch
+import booko
+from filters import FieldFilter
+from models import Field, Tenant, TenantResult
+
+logger = logging.getLogger(__name__)
+
+# seconds between two polls of every watch
+WATCH_INTERVAL = float(os.environ.get("WATCH_INTERVAL", "120"))
+MAX_WATCHES_PER_CHAT = int(os.environ.get("MAX_WATCHES_PER_CHAT", "3"))
+WATCH_CONCURRENCY = int(os.environ.get("WATCH_CONCURRENCY", "4"))
+
+
+@dataclass(slots=True)
+class Watch:
+    chat_id: int
+    coords: tuple[float, float] | None
+    field_names: list | None
+    max_distance: int
+    field_filter: FieldFilter
+    dates: list[date]
+    # (tenant_id, resource_id, slot start) of the slots matching at the last
+    # poll, the first poll reports everything
+    seen: set = field(default_factory=set)
+
+    @classmethod
+    def build(
+        cls,
+        chat_id: int,
+        coords: tuple[float, float] | None,
+        field_names: list | None,
+        max_distance: int,
+        start_hour: str,
+        max_price: int,
+        dates: list[date],
+        surfaces: list | None = None,
+        types: list | None = None,
+    ) -> "Watch":
+        return cls(
+            chat_id,
+            coords,
+            field_names,
+            max_distance,
+            FieldFilter.build(max_price, surfaces, types, start_hour),
+            dates,
+        )
+
+    def diff(
+        self, found: dict[date, list[TenantResult]], failed: set[str] = frozenset()
+    ) -> dict[date, list[TenantResult]]:
+        """The part of `found` not seen at the last poll; `found` becomes the
+        new snapshot, so a slot booked and freed again is notified again.
+        Tenants in `failed` could not be fetched and keep their old slots."""
+        seen = {key for key in self.seen if key[0] in failed}
+        new = {}
+        for _date, tenant_results in found.items():
+            for tenant_result in tenant_results:
+                tenant_id = tenant_result.tenant.tenant_id
+                fields = []
+                for _field in tenant_result.fields:
+                    resource_id = _field.resource.resource_id
+                    slots = []
+                    for slot in _field.slots:
+                        key = (tenant_id, resource_id, slot.start)
+                        seen.add(key)
+                        if key not in self.seen:
+                            slots.append(slot)
+                    if slots:
+                        fields.append(Field(_field.resource, tuple(slots)))
+                if fields:
+                    new.setdefault(_date, []).append(
+                        TenantResult(tenant_result.tenant, fields)
+                    )
+        self.seen = seen
+        return new
+
+
+class WatchRegistry:
+    def __init__(self, max_per_chat: int = MAX_WATCHES_PER_CHAT):
+        self.max_per_chat = max_per_chat
+        self._watches: dict[int, list[Watch]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return sum(len(watches) for watches in self._watches.values())
+
+    def add(self, watch: Watch) -> bool:
+        """Register `watch`, False when its chat has too many already."""
+        watches = self._watches[watch.chat_id]
+        if len(watches) >= self.max_per_chat:
+            return False
+        watches.append(watch)
+        return True
+
+    def remove(self, chat_id: int) -> int:
+        """Drop every watch of `chat_id`, returning how many there were."""
+        return len(self._watches.pop(chat_id, []))
+
+    def expire(self, today: date | None = None) -> None:
+        """Forget past dates, and the watches left without any."""
+        today = today or date.today()
+        for chat_id in list(self._watches):
+            watches = self._watches[chat_id]
+            for watch in watches:
+                watch.dates = [_date for _date in watch.dates if _date >= today]
+            watches[:] = [watch for watch in watches if watch.dates]
+            if not watches:
+                del self._watches[chat_id]
+
+    async def poll(
+        self, concurrency: int = WATCH_CONCURRENCY
+    ) -> dict[int, dict[date, list[TenantResult]]]:
+        """Fetch what every watch needs, once, and return the new slots of
+        each chat with any."""
+        self.expire()
+        watches = [watch for chat in self._watches.values() for watch in chat]
+        if not watches:
+            return {}
+
+        tenants_of: dict[int, list[Tenant]] = {}
+        for watch in watches:
+            try:
+                tenants_of[id(watch)] = await booko.get_tenants_async(
+                    watch.coords, watch.field_names, watch.max_distance
+                )
+            except httpx.HTTPError as e:
+                logger.warning("watch of chat %s skipped: %r", watch.chat_id, e)
+
+        availability = await batch.fetch_union(
+            (
+                (tenants_of[id(watch)], watch.dates)
+                for watch in watches
+                if id(watch) in tenants_of
+            ),
+            concurrency,
+        )
+        failed = {
+            tenant_id for tenant_id, by_date in availability.items() if by_date is None
+        }
+
+        notifications: dict[int, dict[date, list[TenantResult]]] = {}
+        for watch in watches:
+            if id(watch) not in tenants_of:
+                continue
+            found = {}
+            for _date in watch.dates:
+                for tenant in tenants_of[id(watch)]:
+                    by_date = availability[tenant.tenant_id]
+                    if by_date is None:
+                        continue
+                    tenant_result = watch.field_filter(tenant, by_date[_date])
+                    if tenant_result is not None:
+                        found.setdefault(_date, []).append(tenant_result)
+            new = watch.diff(found, failed)
+            for _date, tenant_results in new.items():
+                notifications.setdefault(watch.chat_id, {}).setdefault(
+                    _date, []
+                ).extend(tenant_results)
+        return notifications